@@ -1,302 +1,18 @@
 import os
-import shutil
+import queue
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from PIL import Image
-import exiftool
-import google.generativeai as genai
 import customtkinter as ctk
-import csv
-import sys
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
-from termcolor import colored, cprint
 
-model = None
+from get_keyword import Settings, process_images
+from get_keyword.gemini import model_options
+from get_keyword.metrics import format_duration
+
 directory_path = ""
 output_directory = ""
-generation_config = {
-    "temperature": 0.7,
-    "top_p": 0.95,
-    "top_k": 64,
-    "max_output_tokens": 8192,
-    "response_mime_type": "text/plain",
-}
-model_options = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.0-flash"]
-csv_file_path = ""
-
-def split_text(text, max_length):
-    parts = text.split(';')
-    result = []
-    for part in parts:
-        part = part.strip() 
-        if len(part) <= max_length:
-            result.append(part)
-        else:
-            while len(part) > max_length:
-                result.append(part[:max_length])
-                part = part[max_length:]
-            result.append(part)
-    return result
-
-def check_metadata(image_path):
-    if image_path.lower().endswith('.jpg') or image_path.lower().endswith('.jpeg'):
-        with exiftool.ExifToolHelper() as et:
-            metadata = et.get_metadata(image_path)
-            title = metadata.get('XMP-dc:Title', '')
-            keywords = metadata.get('XMP-dc:Subject', '')
-        return not title or not keywords
-    elif image_path.lower().endswith('.png'):
-        img = Image.open(image_path)
-        metadata = img.info
-        title = metadata.get('Title', '')
-        keywords = metadata.get('Keywords', '')
-        return not title or not keywords
-    return True
-
-def export_metadata_to_csv(filename, title, description, keywords):
-    global csv_file_path
-    file_exists = os.path.isfile(csv_file_path)
-    with open(csv_file_path, mode='a', newline='') as file:
-        writer = csv.writer(file)
-        if not file_exists:
-            writer.writerow(["Filename", "Title", "Description", "Keywords", "Category", "Release"])  # Write header
-        writer.writerow([filename, title, description, keywords])  # Use the filename directly
-
-def resize_image(image_path, max_size=(2048, 2048)):
-    img = Image.open(image_path)
-    img.thumbnail(max_size, Image.LANCZOS)
-    resized_path = os.path.join(output_directory, f"temp_img_{os.path.basename(image_path)}")
-    img.save(resized_path)
-    return resized_path
-
-def process_images(api_key):
-    global model, directory_path, output_directory
-    if not directory_path:
-        messagebox.showerror("Error", "Please select a directory first.")
-        return
-    if not output_directory:
-        messagebox.showerror("Error", "Please select an output directory.")
-        return
-    if not api_key:
-        messagebox.showerror("Error", "Please enter the API Key.")
-        return
-
-    genai.configure(api_key=api_key)
-    model_name = selected_model.get()
-    model = genai.GenerativeModel(model_name=model_name)
-
-    temperature_value = temperature_slider.get()
-    generation_config["temperature"] = temperature_value
-
-    try:
-        if not os.path.exists(output_directory):
-            os.makedirs(output_directory)
-
-        files = [os.path.join(directory_path, f) for f in os.listdir(directory_path) if os.path.isfile(os.path.join(directory_path, f))]
-        failed_files = []
-
-        for image_path in files:
-            try:
-                process_image(image_path)
-            except Exception as e:
-                error_message = str(e)
-                print(f"Processing file...{error_message}")
-                failed_files.append(image_path)
-                continue
-
-        for image_path in failed_files:
-            try:
-                process_image(image_path)
-            except Exception as e:
-                error_message = str(e) 
-                print(f"Success{error_message}")
-
-        for image_path in files:
-            if check_metadata(image_path):
-                try:
-                    process_image(image_path)
-                except Exception as e:
-                    error_message = str(e)
-                    print(f"Checking metadata...{error_message}")
-
-        print("Processing complete.")
-        messagebox.showinfo("Info", "Processing complete.")
-    
-    except Exception as e:
-        error_message = str(e)
-        print(f"Success")
-        messagebox.showinfo("Info", f"Processing complete.\nMaybe some files are not processed, you can try again")
-
-def process_image(image_path):
-    try:
-        cprint(f"---------------------------LOG INFORMATION-------------------------------\n","green",attrs=["blink"])
-        
-        filename = os.path.basename(image_path)
-        print(f"Processing image: {filename}")
-
-        resized_image_path = resize_image(image_path)
-        print(f"Preparing image")
-
-        with Image.open(resized_image_path) as img:
-            print(f"Opened image for processing")
-            
-            if os.path.getsize(resized_image_path) > 20 * 1024 * 1024:
-                print(f"Image size is greater than 20MB, uploading file using File API.")
-                file_ref = genai.upload_file(resized_image_path)
-                print(f"File uploaded, file reference: {file_ref}")
-            else:
-                print(f"Image size is less than or equal to 20MB, processing locally.")
-                file_ref = img
-
-            prompt_title = "Get a short and concise description for the image"
-            response_title = model.generate_content([prompt_title, file_ref],safety_settings={
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE
-            })
-            title_result = response_title.text.strip()
-
-            prompt_tags = "Get relevant tags delimited by semicolon for the image"
-            response_tags = model.generate_content([prompt_tags, file_ref],safety_settings={
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE
-            })
-            tags_result = response_tags.text.strip()
-
-            full_title = title_result
-            if '.' in full_title:
-                title = full_title.split('.')[0]
-            else:
-                title = full_title[:300]
-
-            if len(title) > 300:
-                title = title[:300]
-
-            print(f"Processed title")
-
-            tags = tags_result.split(';')
-            if len(tags) > 49:
-                tags = tags[:49]
-            limited_tags = ';'.join(tags)
-            print(f"Processed tags")
-
-            final_filename = os.path.basename(image_path)
-            final_image_path = image_path
-
-        if rename_enabled.get():
-            print(f"Renaming enabled.")
-            prompt_rename = "Get title for the image"
-            response_rename = model.generate_content([prompt_rename, file_ref],safety_settings={
-            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE
-            })
-            new_filename = sanitize_filename(response_rename.text) + os.path.splitext(image_path)[1]
-            unique_new_path = get_unique_filename(output_directory, new_filename)
-            print(f"Renaming image to: {new_filename}")
-
-            shutil.move(image_path, unique_new_path)
-            final_image_path = unique_new_path  
-            final_filename = new_filename
-
-            print(f"Moved image to {unique_new_path}")
-        else:
-            unique_filename = get_unique_filename(output_directory, os.path.basename(image_path))
-            new_path = os.path.join(output_directory, unique_filename)
-            shutil.move(image_path, new_path)
-            final_image_path = new_path  
-            final_filename = unique_filename
-
-            print(f"Moved image to {new_path}")
-
-        if export_csv_enabled.get():
-            print(f"Exporting metadata to CSV.")
-            export_metadata_to_csv(final_filename, title, title_result, limited_tags)
-
-        commands = ["-overwrite_original"]
-
-        if final_image_path.lower().endswith(('.jpg', '.jpeg')):
-            print(f"Preparing to write metadata for JPG/JPEG image.")
-            commands += [
-                f'-Title={title}',
-                f'-EXIF:XPTitle={title}',
-                f'-XMP:Title={title}',
-                f'-IPTC:Headline={title}',
-                f'-Description={title_result}',
-                f'-XMP:Description={title_result}',
-                f'-EXIF:XPSubject={title_result}',
-                f'-IPTC:Caption-Abstract={title_result}',
-                f'-EXIF:XPKeywords={limited_tags}',
-               
-            ]
-
-            iptc_keywords_parts = split_text(limited_tags, 64)
-            for part in iptc_keywords_parts:
-                commands.append(f'-IPTC:Keywords={part}')
-
-        elif final_image_path.lower().endswith('.png'):
-            print(f"Preparing to write metadata for PNG image.")
-            commands += [
-                f'-Title={title}',
-                f'-EXIF:XPTitle={title}',
-                f'-XMP:Title={title}',
-                f'-IPTC:Headline={title}',
-                f'-Description={title_result}',
-                f'-XMP:Description={title_result}',
-                f'-EXIF:XPSubject={title_result}',
-                f'-IPTC:Caption-Abstract={title_result}',
-                f'-EXIF:XPKeywords={limited_tags}',
-            ]
-
-            iptc_keywords_parts = split_text(limited_tags, 64)
-            for part in iptc_keywords_parts:
-                commands.append(f'-IPTC:Keywords={part}')
-
-        commands.append(final_image_path)
-
-        try:
-            with exiftool.ExifTool() as et:
-                et.execute(*commands)
-            print(f"Metadata written to image")
-        except exiftool.exceptions.ExifToolExecuteError as e:
-            print(f"ExifTool error: {e}")
-            raise
-
-    except Exception as e:
-        print(f"Error processing image {image_path}: {e}")
-        raise
-
-    finally:
-        if os.path.exists(resized_image_path):
-            try:
-                os.remove(resized_image_path)
-                print(f"Removed temp image")
-            except Exception as e:
-                print(f"Error removing temp image: {e}")
-        cprint(f"-------------------------------LOG END-----------------------------------\n","green",attrs=["blink"])
-
-
-def get_unique_filename(directory, filename):
-    base, extension = os.path.splitext(filename)
-    counter = 1
-    unique_filename = filename
-    while os.path.exists(os.path.join(directory, unique_filename)):
-        unique_filename = f"{base}_{counter}{extension}"
-        counter += 1
-    return os.path.join(directory, unique_filename)
-
-def sanitize_filename(filename):
-    return "".join(c if c.isalnum() or c in (" ", ".", "_") else "_" for c in filename)
-
-def move_file(file_path, target_directory):
-    if not os.path.exists(target_directory):
-        os.makedirs(target_directory)
-    unique_filename = get_unique_filename(target_directory, os.path.basename(file_path))
-    shutil.move(file_path, os.path.join(target_directory, unique_filename))
+assets_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
 
 def select_directory(dir_label):
     global directory_path
@@ -305,11 +21,10 @@ def select_directory(dir_label):
         dir_label.configure(text=f"{directory_path}")
 
 def select_output_directory(output_label):
-    global output_directory, csv_file_path
+    global output_directory
     output_directory = filedialog.askdirectory()
     if output_directory:
         output_label.configure(text=f"{output_directory}")
-        csv_file_path = os.path.join(output_directory, "metadata.csv")
 
 ctk.set_appearance_mode("dark") 
 ctk.set_default_color_theme("dark-blue")  
@@ -388,6 +103,21 @@ export_csv_enabled = tk.BooleanVar(value=False)
 export_csv_checkbox = ctk.CTkCheckBox(rename_checkbox_frame, text="Export to CSV", variable=export_csv_enabled, checkbox_width=14, checkbox_height=14, border_width=1,hover_color="#1d560c", corner_radius=3, font=("Segoe UI Bold", 14), fg_color="#6ccc4f")
 export_csv_checkbox.pack(side="left", padx=20, anchor="center")
 
+reuse_duplicates_enabled = tk.BooleanVar(value=False)
+
+reuse_duplicates_checkbox = ctk.CTkCheckBox(rename_checkbox_frame, text="Reuse Duplicates", variable=reuse_duplicates_enabled, checkbox_width=14, checkbox_height=14, border_width=1,hover_color="#1d560c", corner_radius=3, font=("Segoe UI Bold", 14), fg_color="#6ccc4f")
+reuse_duplicates_checkbox.pack(side="left", anchor="center")
+
+skip_tagged_enabled = tk.BooleanVar(value=False)
+
+skip_tagged_checkbox = ctk.CTkCheckBox(rename_checkbox_frame, text="Skip Tagged", variable=skip_tagged_enabled, checkbox_width=14, checkbox_height=14, border_width=1,hover_color="#1d560c", corner_radius=3, font=("Segoe UI Bold", 14), fg_color="#6ccc4f")
+skip_tagged_checkbox.pack(side="left", padx=20, anchor="center")
+
+watch_enabled = tk.BooleanVar(value=False)
+
+watch_checkbox = ctk.CTkCheckBox(rename_checkbox_frame, text="Watch Folder", variable=watch_enabled, checkbox_width=14, checkbox_height=14, border_width=1,hover_color="#1d560c", corner_radius=3, font=("Segoe UI Bold", 14), fg_color="#6ccc4f")
+watch_checkbox.pack(side="left", anchor="center")
+
 label_2 = ctk.CTkLabel(header_frame, pady=(20))
 customize_main_label(label_2, "© 2024 Kadang_Kesel", font_size=9)
 
@@ -429,27 +159,120 @@ customize_main_label(ctk.CTkLabel(frame), "Enter your Gemini API key:", font_siz
 api_key_entry = ctk.CTkEntry(frame)
 customize_entry(api_key_entry)
 
+workers_frame = ctk.CTkFrame(frame, fg_color="transparent")
+workers_frame.pack(pady=1, anchor="center")
+
+workers_label = ctk.CTkLabel(workers_frame, text="Concurrent requests:", font=("Segoe UI Bold", 12))
+workers_label.pack(side="left", padx=10)
+
+selected_workers = tk.StringVar(value="8")
+workers_dropdown = ctk.CTkComboBox(workers_frame, values=["1", "2", "4", "8", "16"], variable=selected_workers, width=70, border_color="#6ccc4f", fg_color="#1d3815", button_color="#6ccc4f", button_hover_color="#1d560c")
+workers_dropdown.pack(side="left")
+
+processing_events = queue.Queue()
+cancel_event = threading.Event()
+
 def start_processing():
-    api_key = api_key_entry.get()
-    process_images(api_key)
-    
+    try:
+        workers = int(selected_workers.get())
+    except ValueError:
+        messagebox.showerror("Error", "Concurrent requests must be a number.")
+        return
+    settings = Settings(
+        input_dir=directory_path,
+        output_dir=output_directory,
+        api_key=api_key_entry.get(),
+        model_name=selected_model.get(),
+        temperature=temperature_slider.get(),
+        rename=rename_enabled.get(),
+        export_csv=export_csv_enabled.get(),
+        workers=workers,
+        reuse_duplicates=reuse_duplicates_enabled.get(),
+        skip_tagged=skip_tagged_enabled.get(),
+        watch=watch_enabled.get(),
+        # Worker processes re-import the main script, which builds this window at
+        # import time; Pillow releases the GIL while decoding, so threads still help.
+        prepare_in_processes=False,
+    )
+    try:
+        settings.validate()
+    except ValueError as e:
+        messagebox.showerror("Error", str(e))
+        return
+
+    cancel_event.clear()
+    process_button.configure(state="disabled")
+    stop_button.configure(state="normal")
+    status_label.configure(text="Starting...")
+    progress_bar.set(0)
+    throughput_label.configure(text="")
+    worker = threading.Thread(target=process_images, args=(settings, processing_events, cancel_event), daemon=True)
+    worker.start()
+    root.after(100, poll_processing_events)
+
+def stop_processing():
+    cancel_event.set()
+    stop_button.configure(state="disabled")
+    status_label.configure(text="Stopping...")
+
+def poll_processing_events():
+    while True:
+        try:
+            event = processing_events.get_nowait()
+        except queue.Empty:
+            break
+        if event[0] == "progress":
+            _, processed, failed, total, scan_done, rate, eta = event
+            total_text = f"{total}" if scan_done else f"{total}+"
+            if not cancel_event.is_set():
+                status_label.configure(text=f"Processed {processed}/{total_text}, failed {failed}")
+            if total:
+                progress_bar.set((processed + failed) / total)
+            eta_text = f", ETA {format_duration(eta)}" if eta is not None else ""
+            throughput_label.configure(text=f"{rate:.1f} images/min{eta_text}")
+        elif event[0] == "error":
+            messagebox.showerror("Error", event[1])
+        elif event[0] == "done":
+            _, message, processed, failed = event
+            process_button.configure(state="normal")
+            stop_button.configure(state="disabled")
+            status_label.configure(text=f"Processed {processed}, failed {failed}")
+            throughput_label.configure(text="")
+            messagebox.showinfo("Info", message)
+            return
+    root.after(100, poll_processing_events)
+
 process_button = ctk.CTkButton(frame, border_color="#6ccc4f", border_width=1, corner_radius=8)
 customize_button(process_button, "Start", command=start_processing)
 
+stop_button = ctk.CTkButton(frame, border_color="#6ccc4f", border_width=1, corner_radius=8)
+customize_button(stop_button, "Stop", command=stop_processing)
+stop_button.configure(state="disabled")
+
+status_label = ctk.CTkLabel(frame)
+customize_regular_label(status_label, "")
+
+progress_bar = ctk.CTkProgressBar(frame, width=300, progress_color="#6ccc4f", fg_color="#1d3815")
+progress_bar.set(0)
+progress_bar.pack(pady=5, anchor="center")
+
+throughput_label = ctk.CTkLabel(frame)
+customize_regular_label(throughput_label, "")
+
 def open_url(url):
     import webbrowser
     webbrowser.open(url, new=1)
 
 social_frame = ctk.CTkFrame(frame, fg_color="transparent")
-social_frame.pack(pady=(120,0), anchor="center")
+social_frame.pack(pady=(40,0), anchor="center")
 
-instagram_button = ctk.CTkButton(social_frame, border_color="white", fg_color="transparent", hover_color="#eeeeee", border_width=1, corner_radius=8, image=ctk.CTkImage(Image.open(r'.\assets\instagram.png')), text="", width=32, height=32, command=lambda: open_url("https://www.instagram.com/hadiyuli_"))
+instagram_button = ctk.CTkButton(social_frame, border_color="white", fg_color="transparent", hover_color="#eeeeee", border_width=1, corner_radius=8, image=ctk.CTkImage(Image.open(os.path.join(assets_directory, "instagram.png"))), text="", width=32, height=32, command=lambda: open_url("https://www.instagram.com/hadiyuli_"))
 instagram_button.pack(side="left", padx=10)
 
-paypal_button = ctk.CTkButton(social_frame, border_color="white", fg_color="transparent", hover_color="#eeeeee", border_width=1, corner_radius=8, image=ctk.CTkImage(Image.open(r'.\assets\paypal.png')), text="", width=32, height=32, command=lambda: open_url("paypal.me/KadangKesel"))
+paypal_button = ctk.CTkButton(social_frame, border_color="white", fg_color="transparent", hover_color="#eeeeee", border_width=1, corner_radius=8, image=ctk.CTkImage(Image.open(os.path.join(assets_directory, "paypal.png"))), text="", width=32, height=32, command=lambda: open_url("paypal.me/KadangKesel"))
 paypal_button.pack(side="left", padx=10)
 
-github_button = ctk.CTkButton(social_frame, border_color="white", fg_color="transparent", hover_color="#eeeeee", border_width=1, corner_radius=8, image=ctk.CTkImage(Image.open(r'.\assets\github.png')), text="", width=32, height=32, command=lambda: open_url("https://github.com/kadangkesel"))
+github_button = ctk.CTkButton(social_frame, border_color="white", fg_color="transparent", hover_color="#eeeeee", border_width=1, corner_radius=8, image=ctk.CTkImage(Image.open(os.path.join(assets_directory, "github.png"))), text="", width=32, height=32, command=lambda: open_url("https://github.com/kadangkesel"))
 github_button.pack(side="left", padx=10)
 
 root.mainloop()
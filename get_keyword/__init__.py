@@ -0,0 +1,39 @@
+import importlib
+
+# Submodules are imported on first use so that `import get_keyword` stays
+# cheap and never pulls in the Gemini SDK, exiftool or Pillow up front.
+_exports = {
+    "Settings": "core",
+    "ImageJob": "core",
+    "check_metadata": "prescan",
+    "MetadataIndex": "prescan",
+    "process_image": "core",
+    "resize_image": "imaging",
+    "encode_image": "imaging",
+    "split_text": "core",
+    "Pipeline": "pipeline",
+    "process_images": "pipeline",
+    "open_sink": "sink",
+    "ExifToolPool": "exif",
+    "get_exiftool_pool": "exif",
+    "ResponseCache": "cache",
+    "DuplicateIndex": "duplicates",
+    "phash": "duplicates",
+    "FakeBackend": "backends",
+    "create_backend": "backends",
+    "Metrics": "metrics",
+    "KeyPool": "keys",
+    "RateController": "ratecontrol",
+    "load_api_keys": "keys",
+    "scan_images": "scanner",
+    "watch_images": "scanner",
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(f".{_exports[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,135 @@
+import collections
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+backend_names = ["gemini", "fake"]
+
+
+class BackendError(Exception):
+    pass
+
+class RateLimitError(BackendError):
+    # The backend answered 429 / quota exhausted. retry_after is in seconds, or
+    # None if the backend did not say.
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OverloadedError(BackendError):
+    # 503 / deadline exceeded: the service is overloaded rather than out of quota.
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class BlockedError(BackendError):
+    # The model refused the image (safety filter, recitation, ...); asking again
+    # gets the same answer.
+    retryable = False
+
+
+def create_backend(name, api_key="", model_name="", **options):
+    # A backend is anything with the generate_content(contents, generation_config=...,
+    # safety_settings=...) method of genai.GenerativeModel that returns a response
+    # with a .text attribute.
+    if name == "gemini":
+        from .gemini import GeminiBackend
+
+        return GeminiBackend(api_key, model_name, **options)
+    if name == "fake":
+        return FakeBackend(**options)
+    raise ValueError(f"Unknown backend: {name}")
+
+
+fake_keywords = [
+    "nature", "landscape", "sky", "blue", "green", "sunset", "city", "architecture", "people",
+    "travel", "water", "mountain", "forest", "abstract", "texture", "background", "light",
+    "color", "summer", "winter", "outdoor", "urban", "beauty", "design", "pattern",
+]
+
+class FakeBackend:
+    # Local stand-in for the Gemini API, used by the benchmark and for dry runs.
+    # Answers are derived from the image bytes, so the same image always gets the
+    # same metadata. latency is the median request time in seconds, jitter the sigma
+    # of its log-normal spread; every extra image of a packed request adds
+    # latency_per_image. error_rate injects server errors, with rpm set requests
+    # beyond that many per minute are rejected with RateLimitError, and with
+    # capacity set requests beyond that many in flight fail with OverloadedError.
+    def __init__(self, latency=1.0, jitter=0.3, latency_per_image=0.2, error_rate=0.0, rpm=0, capacity=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.latency_per_image = latency_per_image
+        self.error_rate = error_rate
+        self.rpm = rpm
+        self.capacity = capacity
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.overloaded = 0
+        self.in_flight = 0
+        self._random = random.Random(seed)
+        self._window = collections.deque()
+        self._lock = threading.Lock()
+
+    def _admit(self):
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            while self._window and self._window[0] <= now - 60:
+                self._window.popleft()
+            if self.rpm and len(self._window) >= self.rpm:
+                self.rate_limited += 1
+                raise RateLimitError("429 Resource has been exhausted (e.g. check quota).", self._window[0] + 60 - now)
+            if self.capacity and self.in_flight >= self.capacity:
+                self.overloaded += 1
+                raise OverloadedError("503 The model is overloaded. Please try again later.")
+            self._window.append(now)
+            self.in_flight += 1
+            failed = self._random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            delay = 0.0
+            if self.latency > 0:
+                delay = self._random.lognormvariate(math.log(self.latency), self.jitter)
+        return delay, failed
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None):
+        images = [part["data"] for part in contents if isinstance(part, dict)]
+        delay, failed = self._admit()
+        try:
+            time.sleep(delay + self.latency_per_image * max(0, len(images) - 1))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+        if failed:
+            raise BackendError("500 An internal error has occurred.")
+
+        config = generation_config or {}
+        if config.get("response_mime_type") != "application/json":
+            # Separate prompts of the plain text fallback.
+            metadata = self._metadata(images[0])
+            text = ";".join(metadata["keywords"]) if "tags" in contents[0] else metadata["description"]
+        elif config.get("response_schema", {}).get("type") == "array":
+            text = json.dumps([dict(self._metadata(data), index=index) for index, data in enumerate(images, 1)])
+        else:
+            text = json.dumps(self._metadata(images[0]))
+        prompt_tokens = 258 * len(images) + sum(len(part.split()) for part in contents if isinstance(part, str))
+        output_tokens = len(text) // 4
+        usage = SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=output_tokens, total_token_count=prompt_tokens + output_tokens)
+        return SimpleNamespace(text=text, usage_metadata=usage)
+
+    def _metadata(self, data):
+        digest = hashlib.sha256(data).hexdigest()
+        rng = random.Random(digest)
+        keywords = rng.sample(fake_keywords, 15)
+        return {
+            "title": f"Synthetic {keywords[0]} image {digest[:8]}",
+            "description": f"A synthetic {keywords[0]} image with {keywords[1]} and {keywords[2]}.",
+            "keywords": keywords,
+            "filename": f"synthetic {keywords[0]} {digest[:8]}",
+        }
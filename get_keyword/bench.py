@@ -0,0 +1,339 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from .backends import FakeBackend, backend_names, create_backend
+from .core import ImageJob, Settings, finalize_image, infer_image, prepare_image, write_metadata
+from .journal import Journal
+from .metrics import percentile
+from .pipeline import Pipeline
+from .scanner import scan_images
+
+corpus_extensions = {"JPEG": ".jpg", "PNG": ".png", "TIFF": ".tif", "WEBP": ".webp"}
+default_sizes = [(6000, 4000), (4000, 3000), (1920, 1080)]
+
+
+def synthetic_image(width, height, rng):
+    # Smooth colour blobs plus fine grain noise, so the files decode and compress
+    # roughly like photos instead of like flat colour.
+    import numpy as np
+    from PIL import Image
+
+    grid = rng.integers(0, 256, (max(2, height // 500), max(2, width // 500), 3), dtype=np.uint8)
+    img = Image.fromarray(grid).resize((width, height), Image.BICUBIC)
+    noise = rng.integers(0, 24, (height, width, 3), dtype=np.uint8)
+    return Image.fromarray(np.asarray(img) // 8 * 7 + noise)
+
+def generate_corpus(directory, count=50, sizes=None, formats=("JPEG",), duplicate_ratio=0.1, seed=0):
+    # Writes `count` synthetic images to `directory`. About duplicate_ratio of them
+    # are rescaled and recompressed copies of earlier ones, i.e. near-duplicates.
+    import numpy as np
+    from PIL import Image
+
+    rng = random.Random(seed)
+    pixels = np.random.default_rng(seed)
+    sizes = sizes or default_sizes
+    os.makedirs(directory, exist_ok=True)
+    originals = []
+    for i in range(count):
+        if originals and rng.random() < duplicate_ratio:
+            with Image.open(rng.choice(originals)) as source:
+                img = source.convert("RGB")
+            img = img.resize((int(img.width * 0.9), int(img.height * 0.9)), Image.LANCZOS)
+        else:
+            img = synthetic_image(*rng.choice(sizes), pixels)
+        image_format = rng.choice(formats)
+        path = os.path.join(directory, f"synthetic_{i:05d}{corpus_extensions[image_format]}")
+        if image_format == "JPEG":
+            img.save(path, image_format, quality=rng.choice([75, 85, 92]))
+        else:
+            img.save(path, image_format)
+        originals.append(path)
+    return sorted(originals)
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class MemorySampler:
+    # Polls the resident set size in the background and keeps the peak growth over
+    # the value at __enter__. Covers Pillow and NumPy buffers, which tracemalloc
+    # does not see. peak is None where /proc is not available.
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak = None
+
+    def __enter__(self):
+        self.baseline = _rss()
+        self.peak = 0 if self.baseline is not None else None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        if self.baseline is not None:
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        rss = _rss()
+        if rss is not None:
+            self.peak = max(self.peak, rss - self.baseline)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.baseline is not None:
+            self._thread.join()
+            self._sample()
+
+
+def copy_corpus(corpus, directory):
+    # The pipeline moves its inputs, so every run gets a fresh copy.
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    for path in corpus:
+        shutil.copy(path, directory)
+
+def run_pipeline(settings, model, run_dir):
+    journal = Journal(os.path.join(run_dir, "journal.sqlite"))
+    duplicates = settings.open_duplicate_index()
+    sink = settings.open_sink()
+    pipeline = Pipeline(settings, model, journal=journal, duplicates=duplicates, sink=sink)
+    started, cpu_started = time.perf_counter(), time.process_time()
+    try:
+        with MemorySampler(0.01) as memory:
+            processed, failed = pipeline.run(settings.find_images())
+    finally:
+        if sink is not None:
+            sink.close()
+        if duplicates is not None:
+            duplicates.close()
+        journal.close()
+    elapsed = time.perf_counter() - started
+
+    threads = {"prepare": pipeline.prepare_workers, "inference": settings.workers, "model_request": settings.workers}
+    stages = {}
+    for name in list(Pipeline.stage_states) + ["model_request"]:
+        stats = pipeline.metrics.stats[name]
+        stages[name] = {
+            "calls": stats.count,
+            "images": stats.images,
+            "p50": percentile(stats.durations, 50),
+            "p95": percentile(stats.durations, 95),
+            "cpu": stats.cpu,
+            "tokens": stats.tokens,
+            "utilization": stats.total / (elapsed * threads.get(name, 1)) if elapsed else 0.0,
+        }
+    latencies = pipeline.metrics.stats["image"].durations
+    return {
+        "workers": settings.workers,
+        "batch_size": settings.batch_size,
+        "processed": len(processed),
+        "failed": len(failed),
+        "elapsed": elapsed,
+        "images_per_minute": len(processed) / elapsed * 60 if elapsed else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        # Worker processes preparing images are not part of process_time(); with
+        # forkserver they are not even our children, so os.times() misses them too.
+        "cpu": time.process_time() - cpu_started + pipeline.worker_cpu,
+        "peak_memory": memory.peak,
+        "stages": stages,
+        "limits": dict(pipeline.metrics.gauges),
+    }
+
+def profile_stages(settings, model, paths):
+    # Runs the stages one image at a time on this thread, so CPU time and memory
+    # growth can be attributed to a single stage without the others running.
+    stages = [
+        ("prepare", lambda job: prepare_image(job, settings)),
+        ("inference", lambda job: infer_image(job, model, settings)),
+        ("metadata", write_metadata),
+        ("finalize", lambda job: finalize_image(job, settings)),
+    ]
+    results = {name: {"cpu": [], "memory": []} for name, _ in stages}
+    for path in paths:
+        job = ImageJob(path)
+        for name, func in stages:
+            try:
+                with MemorySampler() as memory:
+                    cpu_started = time.thread_time()
+                    func(job)
+            except Exception as e:
+                print(f"{job.filename}: Profiling stopped at {name}: {e}")
+                break
+            results[name]["cpu"].append(time.thread_time() - cpu_started)
+            if memory.peak is not None:
+                results[name]["memory"].append(memory.peak)
+        job.cleanup()
+    return {
+        name: {
+            "cpu_per_image": sum(values["cpu"]) / len(values["cpu"]) if values["cpu"] else 0.0,
+            "peak_memory": max(values["memory"]) if values["memory"] else None,
+        }
+        for name, values in results.items()
+    }
+
+def run_benchmark(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix="get_keyword-bench-")
+    corpus_dir = os.path.join(workdir, f"corpus-{args.images}-{args.seed}")
+    if os.path.isdir(corpus_dir):
+        corpus = sorted(scan_images(corpus_dir))
+    else:
+        print(f"Generating {args.images} synthetic images in {corpus_dir}")
+        corpus = generate_corpus(corpus_dir, args.images, formats=args.formats, duplicate_ratio=args.duplicates, seed=args.seed)
+
+    def backend():
+        if args.backend == "fake":
+            return FakeBackend(args.latency, args.jitter, args.latency_per_image, args.error_rate, args.rpm, args.capacity, args.seed)
+        return create_backend(args.backend, args.api_key, args.model)
+
+    def settings(workers, run_dir):
+        return Settings(
+            input_dir=os.path.join(run_dir, "input"),
+            output_dir=os.path.join(run_dir, "output"),
+            api_key=args.api_key,
+            backend=args.backend,
+            model_name=args.model,
+            export_csv=True,
+            workers=workers,
+            prepare_workers=args.prepare_workers,
+            adaptive_concurrency=args.adaptive_concurrency,
+            batch_size=args.batch_size,
+            max_attempts=args.max_attempts,
+            cache_enabled=False,
+            reuse_duplicates=args.reuse_duplicates,
+            duplicates_path=os.path.join(run_dir, "duplicates.sqlite"),
+        )
+
+    runs = []
+    for workers in args.workers:
+        run_dir = os.path.join(workdir, f"run-{workers}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        run_settings = settings(workers, run_dir)
+        copy_corpus(corpus, run_settings.input_dir)
+        print(f"Running pipeline with {workers} workers on {len(corpus)} images")
+        runs.append(run_pipeline(run_settings, backend(), run_dir))
+
+    profile = {}
+    if args.profile_sample:
+        run_dir = os.path.join(workdir, "profile")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        profile_settings = settings(1, run_dir)
+        copy_corpus(corpus[:args.profile_sample], profile_settings.input_dir)
+        os.makedirs(profile_settings.output_dir)
+        print(f"Profiling stages on {args.profile_sample} images")
+        profile = profile_stages(profile_settings, backend(), sorted(scan_images(profile_settings.input_dir)))
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {"images": len(corpus), "backend": args.backend, "runs": runs, "profile": profile}
+
+def _mb(value):
+    return "n/a" if value is None else f"{value / 1024 / 1024:.0f} MB"
+
+def format_report(result):
+    lines = []
+    for run in result["runs"]:
+        lines.append(
+            f"workers={run['workers']} batch={run['batch_size']}: {run['processed']} processed, {run['failed']} failed "
+            f"in {run['elapsed']:.1f}s, {run['images_per_minute']:.1f} images/min, "
+            f"latency p50 {run['latency_p50']:.2f}s p95 {run['latency_p95']:.2f}s, "
+            f"CPU {run['cpu']:.1f}s, peak memory +{_mb(run['peak_memory'])}"
+        )
+        if run["limits"]:
+            lines.append("  final " + ", ".join(f"{name} {value}" for name, value in run["limits"].items()))
+        for name, stage in run["stages"].items():
+            lines.append(
+                f"  {name:<13} {stage['calls']:>5} calls  p50 {stage['p50']:.3f}s  p95 {stage['p95']:.3f}s  "
+                f"CPU {stage['cpu']:.1f}s  busy {stage['utilization']:.0%}"
+            )
+    if result["profile"]:
+        lines.append("Per stage, one image at a time:")
+        for name, stage in result["profile"].items():
+            lines.append(f"  {name:<13} CPU {stage['cpu_per_image'] * 1000:.0f} ms/image  peak memory +{_mb(stage['peak_memory'])}")
+    return "\n".join(lines)
+
+def compare(result, baseline, tolerance):
+    # Returns the regressions against a previous --json result: runs with the same
+    # worker count whose throughput dropped by more than `tolerance`.
+    previous = {run["workers"]: run for run in baseline.get("runs", [])}
+    regressions = []
+    for run in result["runs"]:
+        before = previous.get(run["workers"])
+        if before and run["images_per_minute"] < before["images_per_minute"] * (1 - tolerance):
+            regressions.append(
+                f"workers={run['workers']}: {run['images_per_minute']:.1f} images/min, was {before['images_per_minute']:.1f}"
+            )
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m get_keyword.bench",
+        description="Benchmark the processing pipeline on a synthetic image corpus, by default against a local fake model backend.",
+    )
+    parser.add_argument("--images", type=int, default=50, help="number of synthetic images (default: %(default)s)")
+    parser.add_argument("--formats", type=lambda s: s.upper().split(","), default=["JPEG"], help="comma separated image formats of the corpus: JPEG, PNG, TIFF, WEBP (default: JPEG)")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="share of near-duplicate images in the corpus (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the corpus and fake backend (default: %(default)s)")
+    parser.add_argument("--workers", type=lambda s: [int(n) for n in s.split(",")], default=[8], help="comma separated worker counts to run, e.g. 1,4,8,16 (default: 8)")
+    parser.add_argument("--batch-size", type=int, default=1, help="images per model request (default: %(default)s)")
+    parser.add_argument("--prepare-workers", type=int, default=0, help="images decoded and resized in parallel, 0 for one per CPU core (default: %(default)s)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="attempts per image before giving up (default: %(default)s)")
+    parser.add_argument("--reuse-duplicates", action="store_true", help="reuse the metadata of near-duplicate images")
+    parser.add_argument("--backend", choices=backend_names, default="fake", help="model backend; 'gemini' spends real API quota (default: %(default)s)")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY", ""), help="Gemini API key for --backend gemini (default: $GEMINI_API_KEY)")
+    parser.add_argument("--model", default="gemini-1.5-flash", help="model name for --backend gemini (default: %(default)s)")
+    parser.add_argument("--latency", type=float, default=1.5, help="median fake request latency in seconds (default: %(default)s)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="log-normal sigma of the fake latency (default: %(default)s)")
+    parser.add_argument("--latency-per-image", type=float, default=0.2, help="extra fake latency per additional image of a packed request (default: %(default)s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake requests failing with a server error (default: %(default)s)")
+    parser.add_argument("--rpm", type=int, default=0, help="fake requests per minute before answering 429, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--capacity", type=int, default=0, help="fake requests in flight before answering 503, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--fixed-concurrency", dest="adaptive_concurrency", action="store_false", help="do not adapt the number of requests in flight")
+    parser.add_argument("--profile-sample", type=int, default=10, help="images to run through the stages one at a time for CPU and memory per stage, 0 to skip (default: %(default)s)")
+    parser.add_argument("--workdir", default="", help="directory for the corpus and runs, kept afterwards (default: a temporary directory)")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    parser.add_argument("--json", default="", help="also write the results as JSON to this file")
+    parser.add_argument("--baseline", default="", help="JSON results of an earlier run; exit with 1 if throughput regressed")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed throughput drop against --baseline (default: %(default)s)")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.backend == "gemini" and not args.api_key:
+        parser.error("--backend gemini needs --api-key or $GEMINI_API_KEY")
+    unknown = [f for f in args.formats if f not in corpus_extensions]
+    if unknown:
+        parser.error(f"unsupported corpus format: {', '.join(unknown)}")
+
+    result = run_benchmark(args)
+    print(format_report(result))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Throughput regression: {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
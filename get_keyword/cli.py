@@ -0,0 +1,140 @@
+import argparse
+import os
+import threading
+
+from .backends import backend_names
+from .gemini import model_options
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="get-keyword",
+        description="Generate titles, descriptions and keywords for images with Gemini AI and write them to the image metadata.",
+    )
+    parser.add_argument("input_dir", help="directory containing the images to process")
+    parser.add_argument("output_dir", help="directory the processed images are moved to")
+    parser.add_argument("--api-key", default=os.environ.get("GEMINI_API_KEY", ""), help="Gemini API key, or several separated by commas (default: $GEMINI_API_KEY)")
+    parser.add_argument("--api-keys-file", default="", help="file with one API key per line, optionally followed by rpm=, tpm= and rpd= limits; keys in $GEMINI_API_KEYS are added too")
+    parser.add_argument("--key-rpm", type=int, default=0, help="requests per minute allowed per key, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--key-tpm", type=int, default=0, help="tokens per minute allowed per key, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--key-rpd", type=int, default=0, help="requests per day allowed per key, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--backend", choices=backend_names, default="gemini", help="model backend; 'fake' answers locally without calling the API (default: %(default)s)")
+    parser.add_argument("--model", default=model_options[0], help=f"model name, e.g. {', '.join(model_options)} (default: %(default)s)")
+    parser.add_argument("--temperature", type=float, default=0.7, help="sampling temperature (default: %(default)s)")
+    parser.add_argument("--rename", action="store_true", help="rename images using the generated file name")
+    parser.add_argument("--csv", dest="export_csv", action="store_true", help="export the metadata to a metadata file in the output directory")
+    parser.add_argument("--export-format", choices=["csv", "jsonl", "parquet"], default="csv", help="format of the exported metadata (default: %(default)s)")
+    parser.add_argument("--category", default="", help="value for the Category column of exported rows")
+    parser.add_argument("--release", default="", help="value for the Release column of exported rows")
+    parser.add_argument("--workers", type=int, default=8, help="maximum number of concurrent model requests (default: %(default)s)")
+    parser.add_argument("--rpm", type=int, default=0, help="cap on model requests per minute over all keys, 0 to only slow down on 429 responses (default: %(default)s)")
+    parser.add_argument("--fixed-concurrency", dest="adaptive_concurrency", action="store_false", help="always keep --workers requests in flight instead of adapting to 429/503 responses and latency")
+    parser.add_argument("--batch-size", type=int, default=1, help="pack up to this many images into one model request (default: %(default)s)")
+    parser.add_argument("--batch-max-kb", type=int, default=8192, help="byte budget in KB for the images of one packed request (default: %(default)s)")
+    parser.add_argument("--max-side", type=int, default=1536, help="longest side in pixels of the image sent to the model (default: %(default)s)")
+    parser.add_argument("--image-max-kb", type=int, default=2048, help="byte budget in KB for the image sent to the model (default: %(default)s)")
+    parser.add_argument("--image-format", choices=["JPEG", "WEBP"], type=str.upper, default="JPEG", help="encoding of the image sent to the model (default: %(default)s)")
+    parser.add_argument("--prepare-workers", type=int, default=0, help="images decoded and resized in parallel, 0 for one per CPU core (default: %(default)s)")
+    parser.add_argument("--prepare-threads", dest="prepare_in_processes", action="store_false", help="decode and resize images in threads instead of worker processes")
+    parser.add_argument("--metadata-batch-size", type=int, default=200, help="images whose tags are written with one exiftool call (default: %(default)s)")
+    parser.add_argument("--max-attempts", type=int, default=3, help="attempts per image before giving up (default: %(default)s)")
+    parser.add_argument("--journal", default="", help="job journal used to resume interrupted runs (default: OUTPUT_DIR/.get_keyword-journal.sqlite)")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false", help="only process the top level of the input directory, not its subdirectories")
+    parser.add_argument("--min-size-kb", type=int, default=0, help="ignore images smaller than this many KB (default: %(default)s)")
+    parser.add_argument("--max-size-mb", type=int, default=0, help="ignore images larger than this many MB, 0 for no limit (default: %(default)s)")
+    parser.add_argument("--watch", action="store_true", help="keep running and process images as they are added to the input directory, until interrupted")
+    parser.add_argument("--watch-debounce", type=float, default=2.0, help="seconds a new file must stay unchanged before it is processed (default: %(default)s)")
+    parser.add_argument("--watch-poll-interval", type=float, default=5.0, help="rescan interval in seconds where inotify is not available (default: %(default)s)")
+    parser.add_argument("--skip-tagged", action="store_true", help="skip images that already have a title and keywords")
+    parser.add_argument("--no-cache", dest="cache_enabled", action="store_false", help="bypass the on-disk response cache")
+    parser.add_argument("--cache-path", default="", help="response cache database (default: ~/.cache/get_keyword/responses.sqlite)")
+    parser.add_argument("--cache-max-mb", type=int, default=512, help="maximum response cache size in MB (default: %(default)s)")
+    parser.add_argument("--cache-max-age-days", type=int, default=30, help="drop cached responses older than this (default: %(default)s)")
+    parser.add_argument("--reuse-duplicates", action="store_true", help="reuse the metadata of a near-duplicate image instead of calling the model")
+    parser.add_argument("--duplicate-threshold", type=int, default=6, help="maximum perceptual hash distance for near-duplicates (default: %(default)s)")
+    parser.add_argument("--duplicates-path", default="", help="near-duplicate index database (default: ~/.cache/get_keyword/duplicates.sqlite)")
+    parser.add_argument("--metrics", default="", help="write a JSON line per timed span (stage, model request, image) to this file")
+    parser.add_argument("--trace", default="", help="write a Chrome trace of the run to this file, for chrome://tracing or ui.perfetto.dev")
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    from .core import Settings
+    from .pipeline import process_images
+
+    settings = Settings(
+        input_dir=args.input_dir,
+        output_dir=args.output_dir,
+        api_key=args.api_key,
+        backend=args.backend,
+        api_keys_file=args.api_keys_file,
+        key_rpm=args.key_rpm,
+        key_tpm=args.key_tpm,
+        key_rpd=args.key_rpd,
+        model_name=args.model,
+        temperature=args.temperature,
+        rename=args.rename,
+        export_csv=args.export_csv,
+        export_format=args.export_format,
+        category=args.category,
+        release=args.release,
+        workers=args.workers,
+        requests_per_minute=args.rpm,
+        adaptive_concurrency=args.adaptive_concurrency,
+        batch_size=args.batch_size,
+        batch_max_bytes=args.batch_max_kb * 1024,
+        max_side=args.max_side,
+        image_max_bytes=args.image_max_kb * 1024,
+        image_format=args.image_format,
+        prepare_workers=args.prepare_workers,
+        prepare_in_processes=args.prepare_in_processes,
+        metadata_batch_size=args.metadata_batch_size,
+        max_attempts=args.max_attempts,
+        journal_path=args.journal,
+        skip_tagged=args.skip_tagged,
+        recursive=args.recursive,
+        min_file_size=max(1, args.min_size_kb * 1024),
+        max_file_size=args.max_size_mb * 1024 * 1024,
+        watch=args.watch,
+        watch_debounce=args.watch_debounce,
+        watch_poll_interval=args.watch_poll_interval,
+        cache_enabled=args.cache_enabled,
+        cache_path=args.cache_path,
+        cache_max_mb=args.cache_max_mb,
+        cache_max_age_days=args.cache_max_age_days,
+        reuse_duplicates=args.reuse_duplicates,
+        duplicate_threshold=args.duplicate_threshold,
+        duplicates_path=args.duplicates_path,
+        metrics_path=args.metrics,
+        trace_path=args.trace,
+    )
+    try:
+        settings.validate()
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Run in a worker thread so Ctrl-C can stop the pipeline cleanly: images in
+    # flight are finished or journaled, and the metadata file is finalized.
+    cancel_event = threading.Event()
+    result = []
+    worker = threading.Thread(target=lambda: result.extend(process_images(settings, cancel_event=cancel_event)), daemon=True)
+    worker.start()
+    try:
+        while worker.is_alive():
+            worker.join(0.5)
+    except KeyboardInterrupt:
+        print("Interrupted, stopping...")
+        cancel_event.set()
+        worker.join()
+        if not settings.watch:
+            return 130
+    if not result:
+        return 1
+    processed, failed = result
+
+    print(f"Processed {len(processed)} images, {len(failed)} failed.")
+    for job in failed:
+        print(f"  {job.image_path}: {job.error}")
+    return 1 if failed else 0
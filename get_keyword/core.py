@@ -0,0 +1,492 @@
+import os
+import shutil
+from dataclasses import dataclass
+
+from termcolor import cprint
+
+from .backends import backend_names, create_backend
+from .cache import ResponseCache, cache_key
+from .duplicates import DuplicateIndex, hamming_distance
+from .exif import get_exiftool_pool
+from .gemini import batch_prompt, batch_schema, build_generation_config, generate_metadata, generate_metadata_batch, metadata_prompt, metadata_schema
+from .imaging import prepare_image_data
+from .journal import QUEUED
+from .keys import KeyPool, default_key_state_path, load_api_keys
+from .metrics import ChromeTraceExporter, InstrumentedBackend, JsonlExporter, Metrics
+from .prescan import MetadataIndex, is_tagged, keyword_tags, read_tags, title_tags
+from .scanner import scan_images, watch_images
+from .sink import check_export_format, create_sink, open_sink
+
+
+@dataclass
+class Settings:
+    input_dir: str = ""
+    output_dir: str = ""
+    api_key: str = ""
+    backend: str = "gemini"
+    api_keys_file: str = ""
+    key_rpm: int = 0
+    key_tpm: int = 0
+    key_rpd: int = 0
+    key_state_path: str = ""
+    model_name: str = "gemini-1.5-flash"
+    temperature: float = 0.7
+    rename: bool = False
+    export_csv: bool = False
+    export_format: str = "csv"
+    category: str = ""
+    release: str = ""
+    workers: int = 8
+    requests_per_minute: int = 0
+    adaptive_concurrency: bool = True
+    batch_size: int = 1
+    batch_max_bytes: int = 8 * 1024 * 1024
+    batch_wait: float = 0.5
+    max_side: int = 1536
+    image_max_bytes: int = 2 * 1024 * 1024
+    image_format: str = "JPEG"
+    image_quality: int = 85
+    metadata_batch_size: int = 200
+    metadata_batch_wait: float = 2.0
+    prepare_workers: int = 0
+    prepare_in_processes: bool = True
+    max_attempts: int = 3
+    retry_base_delay: float = 2.0
+    retry_max_delay: float = 60.0
+    journal_path: str = ""
+    skip_tagged: bool = False
+    metadata_index_path: str = ""
+    recursive: bool = True
+    min_file_size: int = 1
+    max_file_size: int = 0
+    watch: bool = False
+    watch_debounce: float = 2.0
+    watch_poll_interval: float = 5.0
+    cache_enabled: bool = True
+    cache_path: str = ""
+    cache_max_mb: int = 512
+    cache_max_age_days: int = 30
+    reuse_duplicates: bool = False
+    duplicate_threshold: int = 6
+    duplicate_wait: float = 120.0
+    duplicates_path: str = ""
+    metrics_path: str = ""
+    trace_path: str = ""
+
+    def open_sink(self):
+        if not self.export_csv:
+            return None
+        return open_sink(self.output_dir, self.export_format)
+
+    @property
+    def generation_config(self):
+        return build_generation_config(self.temperature)
+
+    def validate(self):
+        if not self.input_dir:
+            raise ValueError("Please select a directory first.")
+        if not os.path.isdir(self.input_dir):
+            raise ValueError(f"Input directory does not exist: {self.input_dir}")
+        if not self.output_dir:
+            raise ValueError("Please select an output directory.")
+        if self.backend not in backend_names:
+            raise ValueError(f"Unknown backend: {self.backend}")
+        if self.api_keys_file and not os.path.isfile(self.api_keys_file):
+            raise ValueError(f"API key file does not exist: {self.api_keys_file}")
+        if self.backend == "gemini" and not self.api_keys():
+            raise ValueError("Please enter the API Key.")
+        if self.export_csv:
+            check_export_format(self.export_format)
+
+    def api_keys(self):
+        return load_api_keys(self.api_key, self.api_keys_file, self.key_rpm, self.key_tpm, self.key_rpd)
+
+    def open_key_pool(self):
+        return KeyPool(self.api_keys(), self.key_state_path or default_key_state_path())
+
+    def create_model(self):
+        if self.backend == "gemini":
+            return create_backend(self.backend, self.api_key, self.model_name, key_pool=self.open_key_pool())
+        return create_backend(self.backend, self.api_key, self.model_name)
+
+    def open_cache(self):
+        if not self.cache_enabled:
+            return None
+        return ResponseCache(self.cache_path or None, self.cache_max_mb * 1024 * 1024, self.cache_max_age_days * 24 * 3600)
+
+    def open_duplicate_index(self):
+        if not self.reuse_duplicates:
+            return None
+        return DuplicateIndex(self.duplicates_path or None)
+
+    def open_metadata_index(self):
+        if not self.skip_tagged:
+            return None
+        return MetadataIndex(self.metadata_index_path or None)
+
+    def find_images(self, cancel_event=None, active=None):
+        # The output directory may live inside the input tree; never pick up our own output.
+        options = dict(recursive=self.recursive, min_size=self.min_file_size, max_size=self.max_file_size, exclude=[self.output_dir])
+        if self.watch:
+            return watch_images(
+                self.input_dir, cancel_event, debounce=self.watch_debounce, poll_interval=self.watch_poll_interval, active=active, **options
+            )
+        return scan_images(self.input_dir, **options)
+
+    def target_directory(self, image_path):
+        # Images from subdirectories of the input go to the same subdirectory of the output.
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(image_path)), os.path.abspath(self.input_dir))
+        if not self.input_dir or relative == os.curdir or relative.startswith(os.pardir):
+            return self.output_dir
+        return os.path.join(self.output_dir, relative)
+
+    def open_metrics(self):
+        metrics = Metrics()
+        if self.metrics_path:
+            metrics.add_hook(JsonlExporter(self.metrics_path, metrics.started))
+        if self.trace_path:
+            metrics.add_hook(ChromeTraceExporter(self.trace_path))
+        return metrics
+
+    def request_key(self, image_bytes, batch=False):
+        # Answers to a packed request come from a different prompt, so they are kept apart.
+        prompt = [batch_prompt, batch_schema] if batch else [metadata_prompt, metadata_schema]
+        return cache_key(image_bytes, self.model_name, prompt, self.generation_config)
+
+
+metadata_extensions = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp")
+iptc_extensions = (".jpg", ".jpeg", ".png", ".tif", ".tiff")
+
+
+def split_text(text, max_length):
+    parts = text.split(';')
+    result = []
+    for part in parts:
+        part = part.strip() 
+        if len(part) <= max_length:
+            result.append(part)
+        else:
+            while len(part) > max_length:
+                result.append(part[:max_length])
+                part = part[max_length:]
+            result.append(part)
+    return result
+
+def metadata_row(filename, metadata, settings):
+    return {
+        "Filename": filename,
+        "Title": metadata["title"],
+        "Description": metadata["description"],
+        "Keywords": ';'.join(metadata["keywords"]),
+        "Category": settings.category,
+        "Release": settings.release,
+    }
+
+def get_unique_filename(directory, filename):
+    base, extension = os.path.splitext(filename)
+    counter = 1
+    unique_filename = filename
+    while os.path.exists(os.path.join(directory, unique_filename)):
+        unique_filename = f"{base}_{counter}{extension}"
+        counter += 1
+    return os.path.join(directory, unique_filename)
+
+def sanitize_filename(filename):
+    return "".join(c if c.isalnum() or c in (" ", ".", "_") else "_" for c in filename)
+
+def move_file(file_path, target_directory):
+    if not os.path.exists(target_directory):
+        os.makedirs(target_directory)
+    unique_path = get_unique_filename(target_directory, os.path.basename(file_path))
+    shutil.move(file_path, unique_path)
+    return unique_path
+
+
+class ImageJob:
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self.filename = os.path.basename(image_path)
+        self.image_bytes = None
+        self.mime_type = None
+        self.metadata = None
+        self.phash = None
+        self.final_path = None
+        self.error = None
+        self.state = QUEUED
+        self.attempts = 0
+        self.queued_at = None
+        self.worker_cpu = 0.0
+
+    def image_part(self):
+        return {"mime_type": self.mime_type, "data": self.image_bytes}
+
+    def cleanup(self):
+        self.image_bytes = None
+
+
+def prepare_image(job, settings, executor=None):
+    args = (job.image_path, settings.max_side, settings.image_max_bytes, settings.image_format, settings.image_quality, settings.reuse_duplicates)
+    if executor is None:
+        job.image_bytes, job.mime_type, job.phash, _ = prepare_image_data(*args)
+        job.worker_cpu = 0.0
+    else:
+        # The CPU time of the worker process, which this thread's own does not include.
+        job.image_bytes, job.mime_type, job.phash, job.worker_cpu = executor.submit(prepare_image_data, *args).result()
+    print(f"{job.filename}: Prepared image ({len(job.image_bytes) // 1024} KB)")
+
+def lookup_metadata(job, settings, cache=None, duplicates=None, wait=True, batch=False):
+    # Returns None if the job was answered from the response cache or from a
+    # near-duplicate, otherwise the (cache key, duplicate claim) pair for store_metadata.
+    key = None
+    if cache is not None:
+        key = settings.request_key(job.image_bytes, batch)
+        job.metadata = cache.get(key)
+        if job.metadata is not None:
+            job.cleanup()
+            print(f"{job.filename}: Reused cached title and tags")
+            return None
+
+    claim = None
+    if duplicates is not None and job.phash is not None:
+        match, claim = duplicates.lookup_or_claim(job.phash, settings.duplicate_threshold, timeout=settings.duplicate_wait if wait else 0)
+        if match is not None:
+            distance, duplicate_path, job.metadata = match
+            job.cleanup()
+            print(f"{job.filename}: Reused title and tags of near-duplicate {os.path.basename(duplicate_path)} (distance {distance})")
+            return None
+    return key, claim
+
+def store_metadata(job, cache, duplicates, key, claim):
+    job.cleanup()
+    if key is not None:
+        cache.put(key, job.metadata)
+    if duplicates is not None and job.phash is not None:
+        duplicates.add(job.phash, job.image_path, job.metadata, claim)
+    print(f"{job.filename}: Processed title and tags")
+
+def release_metadata(job, duplicates, claim):
+    if claim is not None:
+        duplicates.release(job.phash, claim)
+
+def infer_image(job, model, settings, cache=None, duplicates=None):
+    lookup = lookup_metadata(job, settings, cache, duplicates)
+    if lookup is None:
+        return
+    key, claim = lookup
+    try:
+        job.metadata = generate_metadata(model, job.image_part(), settings.generation_config)
+    except Exception:
+        release_metadata(job, duplicates, claim)
+        raise
+    store_metadata(job, cache, duplicates, key, claim)
+
+def infer_images(jobs, model, settings, cache=None, duplicates=None):
+    # Packs the jobs that still need the model into one request. Returns a dict of
+    # job -> exception for the jobs that failed.
+    errors = {}
+    pending = []
+    leaders = []
+    followers = []
+    for job in jobs:
+        if duplicates is not None and job.phash is not None:
+            # Near-duplicates within the batch are not in the index yet and would all
+            # go to the model; they take the answer of the first one instead.
+            leader = next((other for other in leaders if hamming_distance(job.phash, other.phash) <= settings.duplicate_threshold), None)
+            if leader is not None:
+                followers.append((job, leader))
+                continue
+            leaders.append(job)
+        try:
+            # Do not wait on near-duplicates in flight: they may be in this very batch.
+            lookup = lookup_metadata(job, settings, cache, duplicates, wait=False, batch=True)
+        except Exception as e:
+            errors[job] = e
+            continue
+        if lookup is not None:
+            pending.append((job, lookup))
+
+    single = set()
+    _infer_batch([job for job, _ in pending], model, settings, errors, single)
+
+    for job, (key, claim) in pending:
+        if key is not None and job in single:
+            # Answered by a request of its own after all, cache it as such.
+            key = settings.request_key(job.image_bytes)
+        if job in errors:
+            release_metadata(job, duplicates, claim)
+        else:
+            store_metadata(job, cache, duplicates, key, claim)
+
+    for job, leader in followers:
+        job.cleanup()
+        if leader in errors:
+            errors[job] = errors[leader]
+            continue
+        job.metadata = leader.metadata
+        print(f"{job.filename}: Reused title and tags of near-duplicate {leader.filename} (distance {hamming_distance(job.phash, leader.phash)})")
+    return errors
+
+def _infer_batch(jobs, model, settings, errors, single):
+    if not jobs:
+        return
+    if len(jobs) == 1:
+        single.add(jobs[0])
+        try:
+            jobs[0].metadata = generate_metadata(model, jobs[0].image_part(), settings.generation_config)
+        except Exception as e:
+            errors[jobs[0]] = e
+        return
+
+    try:
+        results = generate_metadata_batch(model, [job.image_part() for job in jobs], settings.generation_config)
+    except Exception as e:
+        for job in jobs:
+            errors[job] = e
+        return
+
+    missing = []
+    for job, metadata in zip(jobs, results):
+        if metadata is None:
+            missing.append(job)
+        else:
+            job.metadata = metadata
+    if missing:
+        # Incomplete or misaligned answer: retry the missing images in smaller batches.
+        print(f"Batch answer is missing {len(missing)} of {len(jobs)} images, splitting")
+        half = (len(missing) + 1) // 2
+        _infer_batch(missing[:half], model, settings, errors, single)
+        _infer_batch(missing[half:], model, settings, errors, single)
+
+def metadata_tags(image_path, metadata):
+    # The tags to write, in exiftool names; a list value is one entry per item.
+    # WebP has no IPTC block, so there the keywords go to XMP:Subject instead.
+    extension = os.path.splitext(image_path)[1].lower()
+    if extension not in metadata_extensions:
+        return {}
+    iptc = extension in iptc_extensions
+    title = metadata["title"]
+    description = metadata["description"]
+    limited_tags = ';'.join(metadata["keywords"])
+
+    tags = {"Title": title, "EXIF:XPTitle": title, "XMP:Title": title}
+    if iptc:
+        tags["IPTC:Headline"] = title
+    tags.update({"Description": description, "XMP:Description": description, "EXIF:XPSubject": description})
+    if iptc:
+        tags["IPTC:Caption-Abstract"] = description
+    tags["EXIF:XPKeywords"] = limited_tags
+    if iptc:
+        tags["IPTC:Keywords"] = split_text(limited_tags, 64)
+    else:
+        tags["XMP:Subject"] = list(metadata["keywords"])
+    return tags
+
+def check_written(metadata, written):
+    # Returns what is missing from the tags read back after writing, or None. XMP is
+    # written to every supported format, so its title and description must match;
+    # the keywords may be in any of the keyword tags.
+    for tag, key in (("XMP:Title", "title"), ("XMP:Description", "description")):
+        if str(written.get(tag, "")).strip() != metadata[key].strip():
+            return f"{tag} was not written"
+    if metadata["keywords"] and not is_tagged(written):
+        return "keywords were not written"
+    return None
+
+def write_metadata_batch(jobs):
+    # Writes the tags of all jobs with one exiftool call importing them from a JSON
+    # file, then reads them back. Returns a dict of job -> exception for the files
+    # whose tags are not there, which must not be moved.
+    import json
+    import tempfile
+
+    from exiftool.exceptions import ExifToolExecuteError
+
+    entries = {job: metadata_tags(job.image_path, job.metadata) for job in jobs}
+    jobs = [job for job in jobs if entries[job]]
+    if not jobs:
+        return {}
+    paths = [job.image_path for job in jobs]
+    fd, json_path = tempfile.mkstemp(prefix="get_keyword-", suffix=".json")
+    error = None
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump([dict(entries[job], SourceFile=job.image_path) for job in jobs], f, ensure_ascii=False)
+        with get_exiftool_pool().acquire() as et:
+            et.execute("-overwrite_original", f"-json={json_path}", *paths)
+    except ExifToolExecuteError as e:
+        # Usually one bad file; reading the tags back tells which ones were written.
+        error = (getattr(e, "stderr", "") or "").strip() or str(e)
+        print(f"ExifTool error: {error}")
+    except Exception as e:
+        return {job: e for job in jobs}
+    finally:
+        os.remove(json_path)
+
+    try:
+        written = read_tags(paths, title_tags + keyword_tags + ["XMP:Description"], fast=False)
+    except Exception as e:
+        return {job: e for job in jobs}
+    errors = {}
+    for job in jobs:
+        problem = check_written(job.metadata, written[job.image_path])
+        if problem is None:
+            print(f"{job.filename}: Metadata written to image")
+        else:
+            print(f"{job.filename}: {problem}")
+            errors[job] = RuntimeError(f"{problem} ({error})" if error else problem)
+    return errors
+
+def write_metadata(job):
+    errors = write_metadata_batch([job])
+    if job in errors:
+        raise errors[job]
+
+def finalize_image(job, settings, sink=None):
+    if settings.rename:
+        new_filename = sanitize_filename(job.metadata["filename"]) + os.path.splitext(job.image_path)[1]
+    else:
+        new_filename = job.filename
+    target_directory = settings.target_directory(job.image_path)
+    os.makedirs(target_directory, exist_ok=True)
+    job.final_path = get_unique_filename(target_directory, new_filename)
+    shutil.move(job.image_path, job.final_path)
+    print(f"{job.filename}: Moved image to {job.final_path}")
+
+    if sink is not None:
+        sink.write(metadata_row(os.path.basename(job.final_path), job.metadata, settings))
+
+def process_image(image_path, settings, model=None, cache=None, duplicates=None, sink=None, metrics=None):
+    # Processes one image. When calling it in a loop, pass the model and, with
+    # export_csv, an open sink (settings.open_sink()), so they are set up once.
+    cprint(f"---------------------------LOG INFORMATION-------------------------------\n","green",attrs=["blink"])
+    metrics = metrics or Metrics()
+    own_model = None
+    if model is None:
+        model = own_model = settings.create_model()
+    model = InstrumentedBackend(model, metrics)
+    os.makedirs(settings.output_dir, exist_ok=True)
+    job = ImageJob(image_path)
+    print(f"Processing image: {job.filename}")
+    try:
+        with metrics.span("prepare", file=job.filename) as span:
+            prepare_image(job, settings)
+            span["bytes"] = len(job.image_bytes)
+        with metrics.span("inference", file=job.filename):
+            infer_image(job, model, settings, cache, duplicates)
+        with metrics.span("metadata", file=job.filename):
+            write_metadata(job)
+        with metrics.span("finalize", file=job.filename):
+            finalize_image(job, settings, sink)
+            if sink is None and settings.export_csv:
+                row = metadata_row(os.path.basename(job.final_path), job.metadata, settings)
+                create_sink(settings.output_dir, settings.export_format).append([row])
+        return job
+    except Exception as e:
+        print(f"Error processing image {image_path}: {e}")
+        raise
+    finally:
+        job.cleanup()
+        key_pool = getattr(own_model, "key_pool", None)
+        if key_pool is not None:
+            key_pool.close()
+        cprint(f"-------------------------------LOG END-----------------------------------\n","green",attrs=["blink"])
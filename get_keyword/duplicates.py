@@ -0,0 +1,163 @@
+import functools
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import default_cache_dir
+
+
+@functools.lru_cache(maxsize=None)
+def _dct_matrix(size):
+    import numpy as np
+
+    n = np.arange(size)
+    matrix = np.cos(np.pi * (2 * n[None, :] + 1) * n[:, None] / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0, :] /= np.sqrt(2.0)
+    return matrix
+
+def phash(img, hash_size=8, highfreq_factor=4):
+    import numpy as np
+    from PIL import Image
+
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(img.convert("L").resize((size, size), Image.LANCZOS), dtype=np.float64)
+    dct = _dct_matrix(size)
+    low = (dct @ pixels @ dct.T)[:hash_size, :hash_size]
+    # Compare against the median of the low frequencies, leaving out the DC term.
+    bits = low.ravel() > np.median(low.ravel()[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+@functools.lru_cache(maxsize=None)
+def _flip_masks(bits, radius):
+    masks = [0]
+    for count in range(1, radius + 1):
+        for positions in itertools.combinations(range(bits), count):
+            mask = 0
+            for position in positions:
+                mask |= 1 << position
+            masks.append(mask)
+    return masks
+
+
+class MultiIndexHash:
+    # Multi-index hashing: the hash is split into `chunks` substrings, each with its
+    # own lookup table. Two hashes within distance r must agree within r // chunks
+    # bits on at least one substring, so only a handful of buckets are probed and
+    # verified instead of comparing against every indexed hash.
+    def __init__(self, bits=64, chunks=4):
+        self.chunks = chunks
+        self.chunk_bits = bits // chunks
+        self.chunk_mask = (1 << self.chunk_bits) - 1
+        self.tables = [{} for _ in range(chunks)]
+        self.keys = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _chunk(self, key, index):
+        return (key >> (index * self.chunk_bits)) & self.chunk_mask
+
+    def add(self, key, value):
+        entry = len(self.keys)
+        self.keys.append(key)
+        self.values.append(value)
+        for index, table in enumerate(self.tables):
+            table.setdefault(self._chunk(key, index), []).append(entry)
+
+    def search(self, key, max_distance):
+        masks = _flip_masks(self.chunk_bits, max_distance // self.chunks)
+        seen = set()
+        results = []
+        for index, table in enumerate(self.tables):
+            chunk = self._chunk(key, index)
+            for mask in masks:
+                for entry in table.get(chunk ^ mask, ()):
+                    if entry in seen:
+                        continue
+                    seen.add(entry)
+                    distance = hamming_distance(key, self.keys[entry])
+                    if distance <= max_distance:
+                        results.append((distance, self.keys[entry], self.values[entry]))
+        results.sort(key=lambda result: result[0])
+        return results
+
+    def nearest(self, key, max_distance):
+        results = self.search(key, max_distance)
+        return results[0] if results else None
+
+
+class DuplicateIndex:
+    def __init__(self, path=None):
+        self.path = path or os.path.join(default_cache_dir(), "duplicates.sqlite")
+        self.hashes = MultiIndexHash()
+        self.reused = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS phashes ("
+            "hash TEXT NOT NULL, path TEXT NOT NULL, metadata TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+        for hash_hex, path, metadata in self._db.execute("SELECT hash, path, metadata FROM phashes"):
+            self.hashes.add(int(hash_hex, 16), (path, metadata))
+
+    def lookup_or_claim(self, image_hash, threshold, timeout=120):
+        # Returns (match, claim). match is (distance, path, metadata) of a
+        # near-duplicate, or None when the caller should generate metadata itself and
+        # report it with add() or release(), passing the claim along. Callers whose
+        # image is close to one that is still being generated wait for that result
+        # instead of sending the same burst shot to the model twice; if the wait times
+        # out they go ahead without a claim (None), leaving the other one's in place.
+        while True:
+            with self._lock:
+                match = self.hashes.nearest(image_hash, threshold)
+                if match is not None:
+                    distance, _, (path, metadata) = match
+                    self.reused += 1
+                    return (distance, path, json.loads(metadata)), None
+                waiter = None
+                for pending_hash, event in self._pending.items():
+                    if hamming_distance(image_hash, pending_hash) <= threshold:
+                        waiter = event
+                        break
+                if waiter is None:
+                    claim = self._pending[image_hash] = threading.Event()
+                    return None, claim
+            if not waiter.wait(timeout):
+                return None, None
+
+    def add(self, image_hash, path, metadata, claim=None):
+        data = json.dumps(metadata)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO phashes (hash, path, metadata, created_at) VALUES (?, ?, ?, ?)",
+                (f"{image_hash:016x}", path, data, time.time()),
+            )
+            self._db.commit()
+            self.hashes.add(image_hash, (path, data))
+        self.release(image_hash, claim)
+
+    def release(self, image_hash, claim):
+        # Only the claim's owner may drop it; another job may have claimed the same hash.
+        if claim is None:
+            return
+        with self._lock:
+            if self._pending.get(image_hash) is claim:
+                del self._pending[image_hash]
+        claim.set()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,117 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ExifToolPool:
+    def __init__(self, size=None, health_check_interval=60):
+        self.size = size or min(4, os.cpu_count() or 1)
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _start_instance(self):
+        import exiftool
+
+        et = exiftool.ExifToolHelper()
+        et.run()
+        return et
+
+    def _is_healthy(self, et, last_used):
+        if not et.running:
+            return False
+        if time.monotonic() - last_used < self.health_check_interval:
+            return True
+        try:
+            et.execute("-ver")
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise RuntimeError("ExifTool pool is closed")
+                    if self._idle:
+                        et, last_used = self._idle.pop()
+                        break
+                    if self._created < self.size:
+                        self._created += 1
+                        et, last_used = None, None
+                        break
+                    self._cond.wait()
+
+            if et is None:
+                try:
+                    return self._start_instance()
+                except Exception:
+                    self._forget()
+                    raise
+
+            if self._is_healthy(et, last_used):
+                return et
+            print(f"ExifTool process died, restarting")
+            self._discard(et)
+
+    def _checkin(self, et):
+        with self._cond:
+            if not self._closed:
+                self._idle.append((et, time.monotonic()))
+                self._cond.notify()
+                return
+        self._discard(et)
+
+    def _forget(self):
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _discard(self, et):
+        try:
+            et.terminate()
+        except Exception as e:
+            print(f"Error stopping exiftool: {e}")
+        self._forget()
+
+    @contextmanager
+    def acquire(self):
+        from exiftool.exceptions import ExifToolExecuteError, ExifToolTagNameError
+
+        et = self._checkout()
+        try:
+            yield et
+        except (ExifToolExecuteError, ExifToolTagNameError):
+            # exiftool rejected the request, the process itself is still usable.
+            self._checkin(et)
+            raise
+        except BaseException:
+            self._discard(et)
+            raise
+        else:
+            self._checkin(et)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for et, _ in idle:
+            self._discard(et)
+
+
+_exiftool_pool = None
+_exiftool_pool_lock = threading.Lock()
+
+def get_exiftool_pool():
+    global _exiftool_pool
+    with _exiftool_pool_lock:
+        if _exiftool_pool is None:
+            _exiftool_pool = ExifToolPool()
+            atexit.register(_exiftool_pool.close)
+        return _exiftool_pool
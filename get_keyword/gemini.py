@@ -0,0 +1,285 @@
+import json
+
+from .backends import BackendError, BlockedError, OverloadedError, RateLimitError
+from .keys import KeyPool, KeysQuarantinedError, parse_api_keys
+
+model_options = ["gemini-1.5-flash", "gemini-1.5-pro", "gemini-2.0-flash"]
+generation_config = {
+    "temperature": 0.7,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
+metadata_prompt = (
+    "Describe the image for a stock photo agency and answer with a JSON object containing: "
+    "\"title\": a short and concise title for the image; "
+    "\"description\": a short and concise description of the image; "
+    "\"keywords\": a list of up to 49 relevant tags, most relevant first; "
+    "\"filename\": a short descriptive file name for the image, without extension."
+)
+metadata_schema = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "description": {"type": "string"},
+        "keywords": {"type": "array", "items": {"type": "string"}},
+        "filename": {"type": "string"},
+    },
+    "required": ["title", "description", "keywords", "filename"],
+}
+batch_prompt = (
+    "You are given {count} images, each one preceded by its label \"Image N\". "
+    "Describe every image for a stock photo agency and answer with a JSON array containing one object per image with: "
+    "\"index\": the number N from the image label; "
+    "\"title\": a short and concise title for the image; "
+    "\"description\": a short and concise description of the image; "
+    "\"keywords\": a list of up to 49 relevant tags, most relevant first; "
+    "\"filename\": a short descriptive file name for the image, without extension."
+)
+batch_schema = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": dict(metadata_schema["properties"], index={"type": "integer"}),
+        "required": ["index"] + metadata_schema["required"],
+    },
+}
+MAX_TITLE_LENGTH = 300
+MAX_KEYWORDS = 49
+blocked_finish_reasons = {"SAFETY", "RECITATION", "BLOCKLIST", "PROHIBITED_CONTENT", "SPII", "IMAGE_SAFETY"}
+
+
+def _load_json(text, open_char, close_char):
+    text = text.strip()
+    start, end = text.find(open_char), text.rfind(close_char)
+    if start == -1 or end < start:
+        raise ValueError("Response does not contain JSON")
+    try:
+        return json.loads(text[start:end + 1])
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Response is not valid JSON: {e}")
+
+def parse_metadata_response(text):
+    data = _load_json(text, '{', '}')
+    if not isinstance(data, dict):
+        raise ValueError("Response is not a JSON object")
+    return validate_metadata(data)
+
+def validate_metadata(data):
+    title = data.get("title")
+    description = data.get("description")
+    keywords = data.get("keywords")
+    filename = data.get("filename") or ""
+    if not isinstance(title, str) or not title.strip():
+        raise ValueError("Response has no title")
+    if not isinstance(description, str) or not description.strip():
+        raise ValueError("Response has no description")
+    if isinstance(keywords, str):
+        keywords = keywords.split(';')
+    if not isinstance(keywords, list):
+        raise ValueError("Response has no keywords")
+    if not isinstance(filename, str):
+        filename = ""
+
+    return normalize_metadata(title, description, keywords, filename)
+
+def parse_batch_response(text, count):
+    # Maps the answer for a packed request back to image indexes 1..count. Entries
+    # that are invalid, out of range or claimed by more than one object are left
+    # out, so the caller can retry exactly the images that did not come back.
+    data = _load_json(text, '[', ']')
+    if not isinstance(data, list):
+        raise ValueError("Response is not a JSON array")
+    results = {}
+    duplicates = set()
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        try:
+            index = int(item.get("index"))
+            metadata = validate_metadata(item)
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= index <= count:
+            continue
+        if index in results:
+            duplicates.add(index)
+        results[index] = metadata
+    for index in duplicates:
+        del results[index]
+    return results
+
+def normalize_metadata(title, description, keywords, filename=""):
+    title = title.strip()[:MAX_TITLE_LENGTH]
+    description = description.strip()
+    tags = []
+    for keyword in keywords:
+        keyword = str(keyword).replace(';', ',').strip()
+        if keyword and keyword not in tags:
+            tags.append(keyword)
+    if not tags:
+        raise ValueError("Response has no keywords")
+    filename = filename.strip() or title
+    return {
+        "title": title,
+        "description": description,
+        "keywords": tags[:MAX_KEYWORDS],
+        "filename": filename,
+    }
+
+def get_safety_settings():
+    from google.generativeai.types import HarmCategory, HarmBlockThreshold
+
+    return {
+        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+    }
+
+class GeminiBackend:
+    # Every key gets its own client instead of the global genai.configure(), so
+    # requests can be spread over a KeyPool.
+    def __init__(self, api_key, model_name, key_pool=None):
+        import google.generativeai as genai
+        from google.generativeai import client
+
+        self.key_pool = key_pool or KeyPool(parse_api_keys(api_key))
+        self.models = {}
+        for key in self.key_pool.keys:
+            manager = client._ClientManager()
+            manager.configure(api_key=key.key)
+            model = genai.GenerativeModel(model_name=model_name)
+            model._client = manager.get_default_client("generative")
+            self.models[key.key] = model
+
+    def generate_content(self, contents, **kwargs):
+        from google.api_core import exceptions
+
+        images = sum(1 for part in contents if isinstance(part, dict))
+        error = None
+        # A quota error only takes its key out of rotation; try the next key with headroom.
+        for _ in range(len(self.models)):
+            try:
+                key, lease = self.key_pool.acquire(images)
+            except KeysQuarantinedError as e:
+                if error is None:
+                    raise
+                # The keys are out because of the 429 just received, not an earlier one.
+                raise RateLimitError(str(error), e.retry_after) from error
+            try:
+                response = self.models[key.key].generate_content(contents, **kwargs)
+            except (exceptions.TooManyRequests, exceptions.PermissionDenied) as e:
+                self.key_pool.rate_limited(key, lease, retry_after(e))
+                error = e
+                continue
+            except (exceptions.ServiceUnavailable, exceptions.DeadlineExceeded) as e:
+                self.key_pool.failed(key, lease)
+                raise OverloadedError(str(e), retry_after(e)) from e
+            except exceptions.ServerError as e:
+                self.key_pool.failed(key, lease)
+                raise BackendError(str(e)) from e
+            except Exception:
+                self.key_pool.failed(key, lease)
+                raise
+            usage = getattr(response, "usage_metadata", None)
+            self.key_pool.release(key, lease, getattr(usage, "total_token_count", 0) or 0, images)
+            return response
+        raise RateLimitError(str(error), self.key_pool.next_available()) from error
+
+def retry_after(error):
+    # Seconds from a RetryInfo detail ("retryDelay": "17s") or a Retry-After header, if any.
+    for detail in getattr(error, "details", None) or []:
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None and hasattr(delay, "seconds"):
+            return delay.seconds + delay.nanos / 1e9
+        if isinstance(detail, dict) and "retryDelay" in detail:
+            try:
+                return float(str(detail["retryDelay"]).rstrip("s"))
+            except ValueError:
+                pass
+    response = getattr(error, "response", None)
+    header = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    try:
+        return float(header) if header else None
+    except ValueError:
+        return None
+
+def create_model(api_key, model_name, key_pool=None):
+    return GeminiBackend(api_key, model_name, key_pool)
+
+def build_generation_config(temperature):
+    config = dict(generation_config)
+    config["temperature"] = temperature
+    return config
+
+def response_text(response):
+    # response.text raises ValueError for a blocked answer, which must not be taken
+    # for malformed JSON.
+    feedback = getattr(response, "prompt_feedback", None)
+    reason = getattr(feedback, "block_reason", None)
+    if reason:
+        raise BlockedError(f"Prompt blocked ({getattr(reason, 'name', reason)})")
+    candidates = getattr(response, "candidates", None)
+    if candidates is not None:
+        if not candidates:
+            raise BlockedError("Model returned no answer")
+        reason = getattr(candidates[0], "finish_reason", None)
+        if getattr(reason, "name", reason) in blocked_finish_reasons:
+            raise BlockedError(f"Answer blocked ({getattr(reason, 'name', reason)})")
+    try:
+        return response.text
+    except ValueError as e:
+        raise BlockedError(str(e)) from e
+
+def generate_metadata(model, file_ref, config=None):
+    config = dict(config or generation_config)
+    config["response_mime_type"] = "application/json"
+    config["response_schema"] = metadata_schema
+    response = model.generate_content([metadata_prompt, file_ref], generation_config=config, safety_settings=get_safety_settings())
+    text = response_text(response)
+    try:
+        return parse_metadata_response(text)
+    except ValueError as e:
+        print(f"Malformed model response ({e}), falling back to separate prompts.")
+        return generate_metadata_fallback(model, file_ref, config)
+
+def generate_metadata_fallback(model, file_ref, config=None):
+    config = dict(config or generation_config)
+    config["response_mime_type"] = "text/plain"
+    config.pop("response_schema", None)
+    safety_settings = get_safety_settings()
+
+    prompt_title = "Get a short and concise description for the image"
+    response_title = model.generate_content([prompt_title, file_ref], generation_config=config, safety_settings=safety_settings)
+    description = response_text(response_title).strip()
+
+    prompt_tags = "Get relevant tags delimited by semicolon for the image"
+    response_tags = model.generate_content([prompt_tags, file_ref], generation_config=config, safety_settings=safety_settings)
+    tags = response_text(response_tags).strip().split(';')
+
+    if '.' in description:
+        title = description.split('.')[0]
+    else:
+        title = description
+    return normalize_metadata(title, description, tags)
+
+def generate_metadata_batch(model, image_parts, config=None):
+    config = dict(config or generation_config)
+    config["response_mime_type"] = "application/json"
+    config["response_schema"] = batch_schema
+    contents = [batch_prompt.format(count=len(image_parts))]
+    for index, image_part in enumerate(image_parts, 1):
+        contents += [f"Image {index}:", image_part]
+    response = model.generate_content(contents, generation_config=config, safety_settings=get_safety_settings())
+    try:
+        results = parse_batch_response(response_text(response), len(image_parts))
+    except BlockedError as e:
+        # One image can block the whole batch; the caller splits it to find which.
+        print(f"Batch response blocked ({e})")
+        results = {}
+    except ValueError as e:
+        print(f"Malformed batch response ({e})")
+        results = {}
+    return [results.get(index) for index in range(1, len(image_parts) + 1)]
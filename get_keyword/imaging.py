@@ -0,0 +1,72 @@
+import io
+import math
+import time
+
+image_mime_types = {"JPEG": "image/jpeg", "WEBP": "image/webp"}
+sixteen_bit_modes = ("I;16", "I;16L", "I;16B", "I;16N")
+
+
+def resize_image(image_path, max_side=1536):
+    from PIL import Image, ImageOps
+
+    with Image.open(image_path) as img:
+        width, height = img.size
+        scale = max_side / max(width, height)
+        if scale < 1 and img.format == "JPEG":
+            # Let the JPEG decoder scale by 1/2, 1/4 or 1/8 in the DCT domain instead of
+            # decoding the full-size original; draft never goes below the requested size.
+            img.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+        img = to_8bit(ImageOps.exif_transpose(img))
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    return img
+
+def to_8bit(img):
+    # 16-bit greyscale, common in TIFF masters, would clip to white in convert("L").
+    if img.mode in sixteen_bit_modes:
+        return img.convert("I").point(lambda value: value * (1 / 256)).convert("L")
+    return img
+
+def to_rgb(img):
+    from PIL import Image
+
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+def encode_image(img, max_bytes, image_format="JPEG", quality=85, min_quality=50):
+    from PIL import Image
+
+    image_format = image_format.upper()
+    mime_type = image_mime_types[image_format]
+    img = to_rgb(img)
+    while True:
+        for q in range(quality, min_quality - 1, -10):
+            buffer = io.BytesIO()
+            img.save(buffer, format=image_format, quality=q)
+            data = buffer.getvalue()
+            if len(data) <= max_bytes:
+                return data, mime_type
+        # Even the lowest quality is over budget, shrink the image and try again.
+        width, height = img.size
+        if max(width, height) <= 256:
+            return data, mime_type
+        img = img.resize((max(1, int(width * 0.75)), max(1, int(height * 0.75))), Image.LANCZOS)
+
+def prepare_image_data(image_path, max_side=1536, max_bytes=2 * 1024 * 1024, image_format="JPEG", quality=85, with_phash=False):
+    # Decode, resize, hash and encode in one call so it can run in a worker process:
+    # only the path goes in and only the encoded bytes, the hash and the CPU time
+    # spent come back.
+    cpu_started = time.process_time()
+    with resize_image(image_path, max_side) as img:
+        image_hash = None
+        if with_phash:
+            from .duplicates import phash
+
+            image_hash = phash(img)
+        data, mime_type = encode_image(img, max_bytes, image_format, quality)
+    return data, mime_type, image_hash, time.process_time() - cpu_started
@@ -0,0 +1,100 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+QUEUED = "queued"
+PREPARED = "prepared"
+INFERRED = "inferred"
+WRITTEN = "written"
+MOVED = "moved"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def default_journal_path(output_dir):
+    return os.path.join(output_dir, ".get_keyword-journal.sqlite")
+
+def file_signature(path):
+    # (size, mtime_ns) of the file now at `path`, or (None, None) once it is gone.
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, state TEXT NOT NULL, progress TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "error TEXT, metadata TEXT, final_path TEXT, updated_at REAL NOT NULL, size INTEGER, mtime_ns INTEGER)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(files)")}
+        for column in ("size", "mtime_ns"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE files ADD COLUMN {column} INTEGER")
+        self._db.commit()
+
+    def get(self, path):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state, progress, attempts, error, metadata, final_path, size, mtime_ns FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None:
+            return None
+        state, progress, attempts, error, metadata, final_path, size, mtime_ns = row
+        return {
+            "state": state,
+            "progress": progress,
+            "attempts": attempts,
+            "error": error,
+            "metadata": json.loads(metadata) if metadata else None,
+            "final_path": final_path,
+            "size": size,
+            "mtime_ns": mtime_ns,
+        }
+
+    def restore(self, job):
+        # Picks up where a previous run stopped: inferred or written files keep
+        # their metadata so they are not sent to the model again. Only if the file is
+        # still the one recorded; camera file names repeat.
+        entry = self.get(job.image_path)
+        if entry is None or entry["progress"] not in (INFERRED, WRITTEN) or not entry["metadata"]:
+            return False
+        if file_signature(job.image_path) != (entry["size"], entry["mtime_ns"]):
+            return False
+        job.metadata = entry["metadata"]
+        job.state = entry["progress"]
+        return True
+
+    def record(self, job, failed=False, cancelled=False):
+        # `progress` is the last stage the file completed, kept even when it failed
+        # or was cancelled so that a retry or resumed run only repeats the stages
+        # that are left.
+        state = FAILED if failed else CANCELLED if cancelled else job.state
+        metadata = json.dumps(job.metadata) if job.metadata else None
+        size, mtime_ns = file_signature(job.image_path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO files (path, state, progress, attempts, error, metadata, final_path, updated_at, size, mtime_ns) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job.image_path, state, job.state, job.attempts, job.error, metadata, job.final_path, time.time(), size, mtime_ns),
+            )
+            self._db.commit()
+
+    def summary(self):
+        with self._lock:
+            return dict(self._db.execute("SELECT state, COUNT(*) FROM files GROUP BY state").fetchall())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
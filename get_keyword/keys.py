@@ -0,0 +1,220 @@
+import collections
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+from .backends import BackendError, RateLimitError
+from .cache import default_cache_dir
+
+
+class QuotaExhaustedError(BackendError):
+    pass
+
+class KeysQuarantinedError(RateLimitError):
+    # Raised by the pool itself, without a request: every key is sitting out a 429.
+    pass
+
+
+def quota_day():
+    # Gemini daily quotas reset at midnight Pacific time; daylight saving is ignored.
+    return (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=8)).date().isoformat()
+
+def parse_api_keys(text, rpm=0, tpm=0, rpd=0):
+    # One key per line, or several separated by commas or spaces, each optionally
+    # followed by its own limits: "AIza... rpm=15 tpm=1000000 rpd=1500". Lines
+    # starting with # are comments.
+    keys = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0]
+        limits = dict(rpm=rpm, tpm=tpm, rpd=rpd)
+        values = []
+        for token in re.split(r"[\s,]+", line.strip()):
+            name, sep, value = token.partition("=")
+            if sep and name.lower() in limits:
+                limits[name.lower()] = int(value)
+            elif token:
+                values.append(token)
+        keys += [ApiKey(value, **limits) for value in values]
+    return keys
+
+def load_api_keys(api_key="", path="", rpm=0, tpm=0, rpd=0):
+    # Keys from the api_key setting, the keys file and $GEMINI_API_KEYS, without duplicates.
+    text = api_key + "\n" + os.environ.get("GEMINI_API_KEYS", "")
+    if path:
+        with open(path, encoding="utf-8") as f:
+            text += "\n" + f.read()
+    keys = {}
+    for key in parse_api_keys(text, rpm, tpm, rpd):
+        keys.setdefault(key.key, key)
+    return list(keys.values())
+
+
+class ApiKey:
+    def __init__(self, key, rpm=0, tpm=0, rpd=0):
+        self.key = key
+        self.id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        self.name = f"...{key[-4:]}"
+        self.rpm = rpm
+        self.tpm = tpm
+        self.rpd = rpd
+        self.window = collections.deque()
+        self.day = quota_day()
+        self.day_requests = 0
+        self.quarantined_until = 0.0
+        self.strikes = 0
+        self.requests = 0
+        self.tokens = 0
+        self.rate_limited = 0
+        self.errors = 0
+
+    def wait_time(self, now, tokens):
+        # Seconds until a request of `tokens` fits this key's limits, or None if the
+        # key is out of daily quota.
+        day = quota_day()
+        if day != self.day:
+            self.day, self.day_requests = day, 0
+        if self.rpd and self.day_requests >= self.rpd:
+            return None
+        while self.window and self.window[0][0] <= now - 60:
+            self.window.popleft()
+        wait = max(0.0, self.quarantined_until - now)
+        if self.rpm and len(self.window) >= self.rpm:
+            wait = max(wait, self.window[len(self.window) - self.rpm][0] + 60 - now)
+        if self.tpm and self.window:
+            excess = sum(used for _, used in self.window) + tokens - self.tpm
+            for started, used in self.window:
+                if excess <= 0:
+                    break
+                excess -= used
+                wait = max(wait, started + 60 - now)
+        return wait
+
+    def load(self):
+        return len(self.window) / self.rpm if self.rpm else len(self.window)
+
+
+class KeyPool:
+    # Routes each request to the key with the most headroom. Requests and tokens
+    # are counted per key over a sliding minute and per quota day (persisted in
+    # state_path, so several runs on the same day add up); keys answering 429 or
+    # 403 are quarantined with a growing delay.
+    def __init__(self, keys, state_path=None, quarantine=15.0, max_quarantine=600.0):
+        self.keys = keys
+        self.quarantine = quarantine
+        self.max_quarantine = max_quarantine
+        self.tokens_per_image = 600
+        self._cond = threading.Condition()
+        self._db = None
+        if state_path:
+            os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+            self._db = sqlite3.connect(state_path, timeout=30, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS key_usage ("
+                "key_id TEXT NOT NULL, day TEXT NOT NULL, requests INTEGER NOT NULL, tokens INTEGER NOT NULL, "
+                "PRIMARY KEY (key_id, day))"
+            )
+            self._db.commit()
+            for key in keys:
+                row = self._db.execute("SELECT requests FROM key_usage WHERE key_id = ? AND day = ?", (key.id, key.day)).fetchone()
+                key.day_requests = row[0] if row else 0
+
+    def acquire(self, images=1):
+        # Returns (key, lease) for a key that can take the request now, waiting for
+        # the per-minute limits of the first one to free up if necessary. The lease
+        # is passed back to release(), failed() or rate_limited().
+        with self._cond:
+            tokens = self.tokens_per_image * max(1, images)
+            while True:
+                now = time.monotonic()
+                best, wait = None, None
+                for key in self.keys:
+                    key_wait = key.wait_time(now, tokens)
+                    if key_wait is None:
+                        continue
+                    if key_wait <= 0 and (best is None or key.load() < best.load()):
+                        best = key
+                    elif key_wait > 0:
+                        wait = key_wait if wait is None else min(wait, key_wait)
+                if best is not None:
+                    lease = [now, tokens]
+                    best.window.append(lease)
+                    best.day_requests += 1
+                    best.requests += 1
+                    return best, lease
+                if wait is None:
+                    raise QuotaExhaustedError("All API keys are out of daily quota")
+                usable = [key for key in self.keys if key.wait_time(now, 0) is not None]
+                if all(key.quarantined_until > now for key in usable):
+                    # Do not sit out a quarantine here, the caller's retry backoff does that.
+                    raise KeysQuarantinedError("All API keys are rate limited", min(key.quarantined_until for key in usable) - now)
+                self._cond.wait(wait)
+
+    def release(self, key, lease, tokens, images=1):
+        with self._cond:
+            lease[1] = tokens
+            key.tokens += tokens
+            key.strikes = 0
+            if tokens:
+                self.tokens_per_image = int(self.tokens_per_image * 0.9 + tokens / max(1, images) * 0.1)
+            self._cond.notify_all()
+        self._store(key, 1, tokens)
+
+    def failed(self, key, lease):
+        with self._cond:
+            lease[1] = 0
+            key.errors += 1
+            self._cond.notify_all()
+        self._store(key, 1, 0)
+
+    def rate_limited(self, key, lease, retry_after=None):
+        with self._cond:
+            lease[1] = 0
+            key.rate_limited += 1
+            key.strikes += 1
+            delay = retry_after or min(self.max_quarantine, self.quarantine * 2 ** (key.strikes - 1))
+            key.quarantined_until = max(key.quarantined_until, time.monotonic() + delay)
+            print(f"API key {key.name}: quota error, paused for {delay:.0f}s")
+            self._cond.notify_all()
+        self._store(key, 1, 0)
+
+    def next_available(self):
+        # Seconds until any key is out of quarantine, for a Retry-After hint.
+        with self._cond:
+            now = time.monotonic()
+            waits = [key.wait_time(now, 0) for key in self.keys]
+            waits = [wait for wait in waits if wait is not None]
+            return min(waits) if waits else None
+
+    def _store(self, key, requests, tokens):
+        if self._db is None:
+            return
+        with self._cond:
+            self._db.execute(
+                "INSERT INTO key_usage (key_id, day, requests, tokens) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key_id, day) DO UPDATE SET requests = requests + excluded.requests, tokens = tokens + excluded.tokens",
+                (key.id, key.day, requests, tokens),
+            )
+            self._db.commit()
+
+    def report(self):
+        lines = []
+        for key in self.keys:
+            line = f"API key {key.name}: {key.requests} requests, {key.tokens} tokens, {key.rate_limited} rate limited, {key.errors} errors"
+            if key.rpd:
+                line += f", {key.day_requests}/{key.rpd} requests today"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def close(self):
+        if self._db is not None:
+            with self._cond:
+                self._db.close()
+                self._db = None
+
+
+def default_key_state_path():
+    return os.path.join(default_cache_dir(), "keys.sqlite")
@@ -0,0 +1,234 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values) + 0.5) - 1))]
+
+
+class SpanStats:
+    def __init__(self):
+        self.count = 0
+        self.images = 0
+        self.errors = 0
+        self.total = 0.0
+        self.cpu = 0.0
+        self.bytes = 0
+        self.tokens = 0
+        self.durations = []
+
+    def add(self, span):
+        self.count += 1
+        self.images += span.get("images", 1)
+        self.errors += 1 if span.get("error") else span.get("errors", 0)
+        self.total += span["duration"]
+        self.cpu += span.get("cpu", 0.0)
+        self.bytes += span.get("bytes", 0)
+        self.tokens += span.get("total_tokens", 0)
+        self.durations.append(span["duration"])
+
+
+class Metrics:
+    # Collects spans: dicts with a name, start (seconds since the Metrics was
+    # created), duration, cpu, thread, and whatever the caller attached (file,
+    # images, bytes, attempt, token counts, error). Every finished span is added to
+    # the per-name stats and passed to each hook, e.g. the exporters below.
+    def __init__(self, rate_window=60):
+        self.hooks = []
+        self.stats = collections.defaultdict(SpanStats)
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.started = time.time()
+        self.rate_window = rate_window
+        self._origin = time.perf_counter()
+        self._completions = collections.deque()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def now(self):
+        return time.perf_counter() - self._origin
+
+    @contextmanager
+    def span(self, name, **attrs):
+        stack = self._local.__dict__.setdefault("stack", [])
+        span = dict(attrs, name=name, thread=threading.current_thread().name)
+        if stack and span.get("file") is None and stack[-1].get("file") is not None:
+            span["file"] = stack[-1]["file"]
+        stack.append(span)
+        started, cpu_started = self.now(), time.thread_time()
+        try:
+            yield span
+        except BaseException as e:
+            span["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            stack.pop()
+            span["start"] = started
+            span["duration"] = self.now() - started
+            # The caller may have set "cpu" to time spent elsewhere, e.g. in a worker process.
+            span["cpu"] = span.get("cpu", 0.0) + time.thread_time() - cpu_started
+            self.record(span)
+
+    def observe(self, name, start, duration, **attrs):
+        self.record(dict(attrs, name=name, start=start, duration=duration, thread=threading.current_thread().name))
+
+    def record(self, span):
+        span = {key: value for key, value in span.items() if value is not None}
+        with self._lock:
+            self.stats[span["name"]].add(span)
+        for hook in self.hooks:
+            hook(span)
+
+    def increment(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def gauge(self, name, value):
+        # Current value of a setting that changes during the run, e.g. a rate limit.
+        # Hooks get {"name", "start", "value", "thread"}, without a duration.
+        with self._lock:
+            self.gauges[name] = value
+        event = {"name": name, "start": self.now(), "value": value, "thread": threading.current_thread().name}
+        for hook in self.hooks:
+            hook(event)
+
+    def completed(self):
+        now = self.now()
+        with self._lock:
+            self._completions.append(now)
+            while self._completions[0] < now - self.rate_window:
+                self._completions.popleft()
+
+    def rate(self):
+        # Images per minute over the last rate_window seconds.
+        now = self.now()
+        with self._lock:
+            while self._completions and self._completions[0] < now - self.rate_window:
+                self._completions.popleft()
+            count = len(self._completions)
+        window = min(now, self.rate_window)
+        return count / window * 60 if window > 0 else 0.0
+
+    def eta(self, remaining):
+        rate = self.rate()
+        return remaining / rate * 60 if rate > 0 else None
+
+    def summary(self):
+        lines = []
+        for name, stats in sorted(self.stats.items()):
+            line = (
+                f"{name}: {stats.count} spans, {stats.total:.1f}s total, "
+                f"p50 {percentile(stats.durations, 50):.3f}s, p95 {percentile(stats.durations, 95):.3f}s, CPU {stats.cpu:.1f}s"
+            )
+            if stats.bytes:
+                line += f", {stats.bytes // 1024} KB"
+            if stats.tokens:
+                line += f", {stats.tokens} tokens"
+            if stats.errors:
+                line += f", {stats.errors} errors"
+            lines.append(line)
+        for name, value in sorted(self.counters.items()):
+            lines.append(f"{name}: {value}")
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"{name}: {value:g} at the end")
+        return "\n".join(lines)
+
+    def close(self):
+        for hook in self.hooks:
+            close = getattr(hook, "close", None)
+            if close is not None:
+                close()
+
+
+class InstrumentedBackend:
+    # Wraps a backend so every model request becomes a span with the number of
+    # images, the bytes sent and the token counts from the response usage metadata.
+    def __init__(self, backend, metrics):
+        self.backend = backend
+        self.metrics = metrics
+
+    def generate_content(self, contents, **kwargs):
+        images = [part["data"] for part in contents if isinstance(part, dict)]
+        with self.metrics.span("model_request", images=len(images), bytes=sum(len(data) for data in images)) as span:
+            response = self.backend.generate_content(contents, **kwargs)
+            usage = getattr(response, "usage_metadata", None)
+            if usage is not None:
+                span["prompt_tokens"] = getattr(usage, "prompt_token_count", 0)
+                span["output_tokens"] = getattr(usage, "candidates_token_count", 0)
+                span["total_tokens"] = getattr(usage, "total_token_count", 0)
+            return response
+
+
+class JsonlExporter:
+    # One JSON object per span, as they finish.
+    def __init__(self, path, started=None):
+        self.path = path
+        self.started = started or time.time()
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    def __call__(self, span):
+        line = json.dumps(dict(span, time=self.started + span["start"]), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class ChromeTraceExporter:
+    # Trace Event Format, for chrome://tracing or https://ui.perfetto.dev. Stage
+    # spans nest per thread; the scan-to-finish span of every image is an async
+    # event of its own, because those overlap on the same thread. Gauges become
+    # counter tracks.
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self._events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, span):
+        if "duration" not in span:
+            with self._lock:
+                self._events.append({"name": span["name"], "ph": "C", "ts": span["start"] * 1e6, "pid": self.pid, "args": {"value": span["value"]}})
+            return
+        ts, dur = span["start"] * 1e6, span["duration"] * 1e6
+        args = {key: value for key, value in span.items() if key not in ("name", "start", "duration", "thread")}
+        with self._lock:
+            tid = self._threads.setdefault(span["thread"], len(self._threads) + 1)
+            if span["name"] == "image":
+                event = {"name": span.get("file", "image"), "cat": "image", "pid": self.pid, "tid": tid, "id": len(self._events)}
+                self._events.append(dict(event, ph="b", ts=ts, args=args))
+                self._events.append(dict(event, ph="e", ts=ts + dur))
+            else:
+                self._events.append({"name": span["name"], "cat": "stage", "ph": "X", "ts": ts, "dur": dur, "pid": self.pid, "tid": tid, "args": args})
+
+    def close(self):
+        with self._lock:
+            names = [
+                {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                for name, tid in self._threads.items()
+            ]
+            with open(self.path, "w", encoding="utf-8") as f:
+                json.dump({"traceEvents": names + self._events, "displayTimeUnit": "ms"}, f, default=str)
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
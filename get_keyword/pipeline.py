@@ -0,0 +1,468 @@
+import heapq
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import journal as states
+from .core import ImageJob, finalize_image, infer_image, infer_images, prepare_image, write_metadata, write_metadata_batch
+from .journal import Journal, default_journal_path
+from .metrics import InstrumentedBackend, Metrics
+from .ratecontrol import RateControlledBackend, RateController
+
+
+_STOP = object()
+
+class RetryScheduler:
+    def __init__(self, base_delay=2.0, max_delay=60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._heap = []
+        self._counter = 0
+        self._cond = threading.Condition()
+        self._stopped = False
+
+    def delay(self, attempt):
+        # Exponential backoff with jitter so a burst of failures does not come back at once.
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    def schedule(self, job, retry_after=None):
+        # A Retry-After hint from the server wins over a shorter backoff.
+        delay = max(self.delay(job.attempts), retry_after or 0)
+        with self._cond:
+            self._counter += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._counter, job))
+            self._cond.notify()
+
+    def drain(self):
+        with self._cond:
+            jobs = [job for _, _, job in self._heap]
+            self._heap = []
+            return jobs
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+
+    def pop_due(self, timeout):
+        # Returns the next job whose backoff has expired, None if nothing is due
+        # within `timeout`, or _STOP once the scheduler has been stopped.
+        with self._cond:
+            if self._stopped:
+                return _STOP
+            if self._heap:
+                timeout = min(timeout, self._heap[0][0] - time.monotonic())
+            if timeout > 0:
+                self._cond.wait(timeout)
+            if self._stopped:
+                return _STOP
+            if self._heap and self._heap[0][0] <= time.monotonic():
+                return heapq.heappop(self._heap)[2]
+        return None
+
+
+class Pipeline:
+    stage_states = {
+        "prepare": states.PREPARED,
+        "inference": states.INFERRED,
+        "metadata": states.WRITTEN,
+        "finalize": states.MOVED,
+    }
+    state_order = [states.QUEUED, states.PREPARED, states.INFERRED, states.WRITTEN, states.MOVED]
+
+    def __init__(self, settings, model, events=None, cancel_event=None, cache=None, duplicates=None, journal=None, metadata_index=None, sink=None, metrics=None):
+        self.settings = settings
+        self.metrics = metrics or Metrics()
+        self.events = events
+        self.cancel_event = cancel_event or threading.Event()
+        self.rate_controller = RateController(
+            settings.workers, settings.requests_per_minute, settings.adaptive_concurrency, metrics=self.metrics, cancel_event=self.cancel_event
+        )
+        self.model = RateControlledBackend(InstrumentedBackend(model, self.metrics), self.rate_controller)
+        self.cache = cache
+        self.duplicates = duplicates
+        self.journal = journal
+        self.metadata_index = metadata_index
+        self.sink = sink
+        self.workers = max(1, settings.workers)
+        self.prepare_workers = max(1, settings.prepare_workers or os.cpu_count() or 1)
+        self.retries = RetryScheduler(settings.retry_base_delay, settings.retry_max_delay)
+        self.worker_cpu = 0.0
+        self.processed = []
+        self.failed = []
+        self.cancelled = []
+        self.skipped = []
+        # Paths of the jobs in flight, so the watcher does not hand them out twice.
+        self.active = set()
+        self.total = 0
+        self._lock = threading.Lock()
+        self._scan_done = False
+        self._outstanding = 0
+        self._stopped = False
+        self._first_stage = None
+        self._executor = None
+
+    def emit(self, *event):
+        if self.events is not None:
+            self.events.put(event)
+
+    def _progress(self):
+        done = len(self.processed) + len(self.failed) + len(self.cancelled)
+        eta = self.metrics.eta(self.total - done) if self._scan_done else None
+        self.emit("progress", len(self.processed), len(self.failed), self.total, self._scan_done, self.metrics.rate(), eta)
+
+    def _maybe_stop(self):
+        # Called with the lock held. Retries go back into the first queue, so the
+        # pipeline only shuts down once the scan is done and no job is in flight.
+        if self._scan_done and self._outstanding == 0 and not self._stopped:
+            self._stopped = True
+            self.retries.stop()
+            inbox, consumers = self._first_stage
+            for _ in range(consumers):
+                inbox.put(_STOP)
+
+    def _finish(self, job, outcome):
+        job.cleanup()
+        if outcome is self.processed:
+            self.metrics.observe("image", job.queued_at, self.metrics.now() - job.queued_at, file=job.filename, attempts=job.attempts + 1)
+            self.metrics.completed()
+        with self._lock:
+            outcome.append(job)
+            self.active.discard(job.image_path)
+            self._outstanding -= 1
+            self._progress()
+            self._maybe_stop()
+
+    def _cancel(self, job):
+        if self.journal is not None:
+            self.journal.record(job, cancelled=True)
+        self._finish(job, self.cancelled)
+
+    def _fail(self, job, stage, error):
+        if self.cancel_event.is_set():
+            # Most likely the stop itself (the rate controller raises "Cancelled"),
+            # so the job is left for the next run rather than counted as failed.
+            print(f"{job.filename}: Cancelled ({stage}: {error})")
+            self._cancel(job)
+            return
+        job.attempts += 1
+        job.error = f"{stage}: {error}"
+        retry = job.attempts < self.settings.max_attempts and getattr(error, "retryable", True)
+        print(f"Error processing image {job.image_path}: {job.error}")
+        if self.journal is not None:
+            self.journal.record(job, failed=True)
+        self.metrics.increment(f"{stage} errors")
+        if retry:
+            self.metrics.increment("retries")
+            job.cleanup()
+            if job.state == states.PREPARED:
+                job.state = states.QUEUED
+            self.retries.schedule(job, getattr(error, "retry_after", None))
+        else:
+            self._finish(job, self.failed)
+
+    def _jobs(self, paths):
+        tagged = self.metadata_index.tagged(paths) if self.metadata_index is not None else {}
+        for image_path in paths:
+            job = ImageJob(image_path)
+            restored = self.journal is not None and self.journal.restore(job)
+            if not restored and tagged.get(image_path):
+                print(f"{job.filename}: Already tagged, skipping")
+                self.skipped.append(image_path)
+                continue
+            if self.journal is not None:
+                if restored:
+                    print(f"{job.filename}: Resuming from journal ({job.state})")
+                self.journal.record(job)
+            yield job
+
+    def _batches(self, files):
+        # Batch the paths so the already-tagged check costs one exiftool call per batch.
+        batch_size = self.metadata_index.batch_size if self.metadata_index is not None else 1
+        batch = []
+        for image_path in files:
+            if image_path is None:
+                # The watcher is idle: hand over what we have and let _scan check for cancellation.
+                yield batch
+                batch = []
+                continue
+            batch.append(image_path)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _scan(self, files, outbox):
+        try:
+            for batch in self._batches(files):
+                for job in self._jobs(batch):
+                    if self.cancel_event.is_set():
+                        return
+                    job.queued_at = self.metrics.now()
+                    with self._lock:
+                        self.active.add(job.image_path)
+                        self.total += 1
+                        self._outstanding += 1
+                    outbox.put(job)
+                if self.cancel_event.is_set():
+                    return
+        finally:
+            with self._lock:
+                self._scan_done = True
+                self._progress()
+                self._maybe_stop()
+
+    def _collect(self, inbox, jobs, batch_size, batch_wait, max_bytes=0):
+        # Gathers up to batch_size jobs, waiting at most batch_wait after the first
+        # one for the rest. Returns (carry, stop): a job that did not fit the byte
+        # budget and whether the stop marker was seen.
+        budget = max_bytes - len(jobs[0].image_bytes or b"")
+        deadline = time.monotonic() + batch_wait
+        while len(jobs) < batch_size:
+            try:
+                job = inbox.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if job is _STOP:
+                return None, True
+            size = len(job.image_bytes or b"")
+            if max_bytes and size > budget:
+                return job, False
+            budget -= size
+            jobs.append(job)
+        return None, False
+
+    def _stage(self, name, func, inbox, outbox, consumers, remaining, batch=None):
+        state = self.stage_states[name]
+        carry, stop = None, False
+        while not stop:
+            job = carry or inbox.get()
+            carry = None
+            if job is _STOP:
+                break
+            jobs = [job]
+            if batch is not None:
+                carry, stop = self._collect(inbox, jobs, *batch[1:])
+
+            todo, cancelled = [], []
+            for job in jobs:
+                if self.cancel_event.is_set():
+                    cancelled.append(job)
+                    self._cancel(job)
+                elif self.state_order.index(job.state) < self.state_order.index(state):
+                    todo.append(job)
+            errors = {}
+            if todo:
+                filename = todo[0].filename if len(todo) == 1 else None
+                with self.metrics.span(name, file=filename, images=len(todo), attempt=max(job.attempts for job in todo) + 1) as span:
+                    if len(todo) > 1:
+                        errors = batch[0](todo)
+                    else:
+                        try:
+                            func(todo[0])
+                        except Exception as e:
+                            errors[todo[0]] = e
+                    span["errors"] = len(errors)
+                    if state == states.PREPARED:
+                        span["bytes"] = sum(len(job.image_bytes or b"") for job in todo)
+                        span["cpu"] = sum(job.worker_cpu for job in todo if job not in errors)
+                        with self._lock:
+                            self.worker_cpu += span["cpu"]
+
+            for job in jobs:
+                if job in cancelled:
+                    continue
+                if job in errors:
+                    self._fail(job, name, errors[job])
+                    continue
+                if job in todo:
+                    job.state = state
+                    if self.journal is not None and state != states.PREPARED:
+                        self.journal.record(job)
+                if outbox is None:
+                    self._finish(job, self.processed)
+                else:
+                    outbox.put(job)
+
+        # The last worker of a stage to exit tells the next stage to stop.
+        with self._lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last and outbox is not None:
+            for _ in range(consumers):
+                outbox.put(_STOP)
+
+    def _open_executor(self):
+        # Decoding and resizing large originals is CPU bound, so by default it runs in
+        # a pool of processes. They are started with forkserver or spawn, not fork,
+        # because this process already runs threads.
+        if not self.settings.prepare_in_processes or self.prepare_workers < 2:
+            return None
+        import multiprocessing
+
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(self.prepare_workers, mp_context=multiprocessing.get_context(method))
+
+    def _prepare(self, job):
+        executor = self._executor
+        try:
+            prepare_image(job, self.settings, executor)
+        except BrokenProcessPool:
+            # A worker died, e.g. killed for memory on a huge image: replace the pool
+            # and let the retry scheduler try the image again.
+            with self._lock:
+                if self._executor is executor:
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._open_executor()
+            raise
+
+    def _retry(self, outbox):
+        while True:
+            job = self.retries.pop_due(0.5)
+            if job is _STOP:
+                return
+            if self.cancel_event.is_set():
+                for pending in self.retries.drain() + ([job] if job is not None else []):
+                    self._cancel(pending)
+            elif job is not None:
+                print(f"{job.filename}: Retrying (attempt {job.attempts + 1})")
+                outbox.put(job)
+
+    def run(self, files):
+        size = self.workers * 2
+        prepare_q = queue.Queue(maxsize=size)
+        infer_q = queue.Queue(maxsize=size)
+        write_q = queue.Queue(maxsize=size)
+        finalize_q = queue.Queue(maxsize=size)
+        settings, model, cache, duplicates, sink = self.settings, self.model, self.cache, self.duplicates, self.sink
+
+        stages = [
+            ("prepare", self._prepare, prepare_q, infer_q, self.prepare_workers),
+            ("inference", lambda job: infer_image(job, model, settings, cache, duplicates), infer_q, write_q, self.workers),
+            ("metadata", write_metadata, write_q, finalize_q, 1),
+            ("finalize", lambda job: finalize_image(job, settings, sink), finalize_q, None, 1),
+        ]
+        self._first_stage = (prepare_q, stages[0][4])
+        # Stage name -> (batch function, batch size, wait for each extra job, byte budget).
+        batches = {}
+        if settings.batch_size > 1:
+            batch_func = lambda jobs: infer_images(jobs, model, settings, cache, duplicates)
+            batches["inference"] = (batch_func, settings.batch_size, settings.batch_wait, settings.batch_max_bytes)
+        if settings.metadata_batch_size > 1:
+            # Tags are written for a few hundred images per exiftool call; the
+            # finalize stage only ever sees images whose tags were read back.
+            batches["metadata"] = (write_metadata_batch, settings.metadata_batch_size, settings.metadata_batch_wait)
+
+        threads = [
+            threading.Thread(target=self._scan, args=(files, prepare_q), name="scan", daemon=True),
+            threading.Thread(target=self._retry, args=(prepare_q,), name="retry", daemon=True),
+        ]
+        for i, (name, func, inbox, outbox, count) in enumerate(stages):
+            consumers = stages[i + 1][4] if i + 1 < len(stages) else 0
+            remaining = [count]
+            for n in range(count):
+                threads.append(threading.Thread(target=self._stage, args=(name, func, inbox, outbox, consumers, remaining, batches.get(name)), name=f"{name}-{n}", daemon=True))
+
+        self._executor = self._open_executor()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+        return self.processed, self.failed
+
+
+def process_images(settings, events=None, cancel_event=None, model=None):
+    # Setup failures (bad settings, an unwritable output directory, a broken
+    # journal or metrics path) are re-raised, but only after whatever was opened is
+    # closed again and the "error" and "done" events are posted, so a GUI waiting
+    # for "done" is never left hanging.
+    cancel_event = cancel_event or threading.Event()
+    processed, failed = [], []
+    key_pool = journal = cache = duplicates = metadata_index = sink = metrics = None
+    setup_error = None
+    try:
+        try:
+            settings.validate()
+            model = model or settings.create_model()
+            key_pool = getattr(model, "key_pool", None)
+            os.makedirs(settings.output_dir, exist_ok=True)
+            journal = Journal(settings.journal_path or default_journal_path(settings.output_dir))
+            cache = settings.open_cache()
+            duplicates = settings.open_duplicate_index()
+            metadata_index = settings.open_metadata_index()
+            sink = settings.open_sink()
+            metrics = settings.open_metrics()
+        except Exception as e:
+            setup_error = e
+            raise
+
+        pipeline = Pipeline(settings, model, events, cancel_event, cache, duplicates, journal, metadata_index, sink, metrics)
+        if settings.watch:
+            print(f"Watching {settings.input_dir} for new images, stop to finish.")
+        processed, failed = pipeline.run(settings.find_images(cancel_event, pipeline.active))
+
+        print("Processing complete.")
+        message = "Processing complete."
+        if cancel_event.is_set():
+            message = "Processing cancelled."
+        if pipeline.skipped:
+            message += f"\nSkipped {len(pipeline.skipped)} already tagged files."
+        if pipeline.cancelled:
+            message += f"\n{len(pipeline.cancelled)} files were left for the next run."
+        if failed:
+            message += "\nMaybe some files are not processed, you can try again"
+    except Exception as e:
+        if setup_error is not None:
+            print(f"Cannot start processing: {e}")
+            message = "Processing stopped."
+        else:
+            print(f"Processing stopped: {e}")
+            message = "Processing complete.\nMaybe some files are not processed, you can try again"
+    finally:
+        if sink is not None:
+            try:
+                sink.close()
+                print(f"Exported {sink.rows} rows to {sink.path}")
+            except Exception as e:
+                print(f"Error exporting metadata: {e}")
+                message = "Processing complete.\nMetadata export failed, partial output kept in " + sink.partial_path
+        if cache is not None:
+            stats = cache.stats()
+            print(f"Response cache: {stats['hits']} hits, {stats['misses']} misses, {stats['entries']} entries")
+            cache.close()
+        if duplicates is not None:
+            print(f"Near-duplicate index: reused metadata for {duplicates.reused} images, {len(duplicates.hashes)} indexed")
+            duplicates.close()
+        if metadata_index is not None:
+            print(f"Metadata index: {metadata_index.scanned} files scanned, {metadata_index.reused} unchanged")
+            metadata_index.close()
+        if journal is not None:
+            print(f"Journal: {journal.summary()}")
+            journal.close()
+        if key_pool is not None:
+            print(key_pool.report())
+            key_pool.close()
+        if metrics is not None:
+            print(f"Timings:\n{metrics.summary()}")
+            try:
+                metrics.close()
+            except OSError as e:
+                print(f"Error writing metrics: {e}")
+
+    if events is not None:
+        if setup_error is not None:
+            events.put(("error", f"Cannot start processing: {setup_error}"))
+        events.put(("done", message, len(processed), len(failed)))
+    if setup_error is not None:
+        raise setup_error
+    return processed, failed
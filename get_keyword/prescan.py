@@ -0,0 +1,105 @@
+import os
+import sqlite3
+import threading
+import time
+
+from .cache import default_cache_dir
+from .exif import get_exiftool_pool
+
+title_tags = ["XMP:Title", "PNG:Title", "EXIF:XPTitle"]
+keyword_tags = ["XMP:Subject", "IPTC:Keywords", "PNG:Keywords", "EXIF:XPKeywords"]
+
+
+def _first(metadata, tags):
+    for tag in tags:
+        value = metadata.get(tag)
+        if value not in (None, "", []):
+            return value
+    return None
+
+def _normalize(path):
+    return os.path.normcase(os.path.normpath(path))
+
+def is_tagged(metadata):
+    return _first(metadata, title_tags) is not None and _first(metadata, keyword_tags) is not None
+
+def read_tags(paths, tags=None, fast=True):
+    from exiftool.exceptions import ExifToolExecuteError
+
+    if not paths:
+        return {}
+    tags = tags or title_tags + keyword_tags
+    try:
+        with get_exiftool_pool().acquire() as et:
+            results = et.get_tags(paths, tags, params=["-fast"] if fast else [])
+    except ExifToolExecuteError:
+        # One unreadable file fails the whole batch; fall back to reading one at a time.
+        if len(paths) == 1:
+            return {paths[0]: {}}
+        metadata = {}
+        for path in paths:
+            metadata.update(read_tags([path], tags, fast))
+        return metadata
+    by_path = {_normalize(metadata.get("SourceFile", "")): metadata for metadata in results}
+    return {path: by_path.get(_normalize(path), {}) for path in paths}
+
+def check_metadata(image_path):
+    return not is_tagged(read_tags([image_path])[image_path])
+
+
+class MetadataIndex:
+    def __init__(self, path=None, batch_size=200):
+        self.path = path or os.path.join(default_cache_dir(), "metadata_index.sqlite")
+        self.batch_size = batch_size
+        self.scanned = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime REAL NOT NULL, "
+            "tagged INTEGER NOT NULL, scanned_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def tagged(self, paths):
+        # Returns {path: bool}. Files whose size and mtime match the index are answered
+        # from it; the rest are read with one exiftool call per batch and stored.
+        result = {}
+        stale = {}
+        with self._lock:
+            for path in paths:
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                row = self._db.execute("SELECT size, mtime, tagged FROM files WHERE path = ?", (path,)).fetchone()
+                if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+                    result[path] = bool(row[2])
+                    self.reused += 1
+                else:
+                    stale[path] = stat
+
+        stale_paths = list(stale)
+        for start in range(0, len(stale_paths), self.batch_size):
+            batch = stale_paths[start:start + self.batch_size]
+            metadata = read_tags(batch)
+            now = time.time()
+            with self._lock:
+                for path in batch:
+                    result[path] = is_tagged(metadata[path])
+                    stat = stale[path]
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO files (path, size, mtime, tagged, scanned_at) VALUES (?, ?, ?, ?, ?)",
+                        (path, stat.st_size, stat.st_mtime, int(result[path]), now),
+                    )
+                self._db.commit()
+                self.scanned += len(batch)
+        return result
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,155 @@
+import collections
+import threading
+import time
+
+from .backends import BackendError, OverloadedError, RateLimitError
+from .keys import KeysQuarantinedError
+
+
+class RateController:
+    # Decides when the next model request may start. A token bucket caps the
+    # request rate and an AIMD limit caps the requests in flight: it starts at one
+    # and doubles every round trip until the first error (slow start), after that
+    # every success raises it by about one per round trip, a 429/503 halves it (at most
+    # once per round trip, so one burst of errors counts once) and a latency well
+    # above its long-term average cuts it by a tenth. A 429 also halves the request
+    # rate to below what was actually getting through (never below min_rate), every
+    # success raises it again by a twentieth, and a Retry-After hint pauses all
+    # requests until it has passed. Without requests_per_minute the rate is
+    # unlimited until the first 429 that comes after a success; before that there is
+    # nothing to measure, so only the concurrency is halved.
+    def __init__(self, max_concurrency, requests_per_minute=0, adaptive=True, latency_tolerance=2.0, metrics=None, cancel_event=None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_rate = requests_per_minute / 60 if requests_per_minute else None
+        self.min_rate = min(self.max_rate, 0.1) if self.max_rate else 0.1
+        self.adaptive = adaptive
+        self.latency_tolerance = latency_tolerance
+        self.metrics = metrics
+        self.cancel_event = cancel_event or threading.Event()
+        self.limit = 1.0 if adaptive else float(self.max_concurrency)
+        self.slow_start = adaptive
+        self.rate = self.max_rate
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.latency = None
+        self.baseline_latency = None
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._decreased = 0.0
+        self._successes = collections.deque()
+        self._published = None
+        self._cond = threading.Condition()
+        self._publish()
+
+    def _refill(self, now):
+        if self.rate is not None:
+            burst = max(1.0, min(self.limit, self.rate))
+            self._tokens = min(burst, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                if self.cancel_event.is_set():
+                    raise BackendError("Cancelled")
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.in_flight >= max(1, int(self.limit)):
+                    wait = 1.0
+                elif self.rate is not None and self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    if self.rate is not None:
+                        self._tokens -= 1
+                    self.in_flight += 1
+                    return now
+                self._cond.wait(min(wait, 1.0))
+
+    def release(self, started, outcome, retry_after=None):
+        # outcome is "ok", "throttled" (429), "overloaded" (503) or "error"; only the
+        # Retry-After pause applies to an error.
+        now = time.monotonic()
+        with self._cond:
+            self.in_flight -= 1
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            if outcome == "ok":
+                self._succeeded(now, now - started)
+            elif outcome in ("throttled", "overloaded") and self.adaptive:
+                self._decrease(now, 0.5, outcome == "throttled")
+            self._cond.notify_all()
+        self._publish()
+
+    def _succeeded(self, now, latency):
+        self._successes.append(now)
+        while self._successes[0] < now - 60:
+            self._successes.popleft()
+        self.latency = latency if self.latency is None else self.latency * 0.7 + latency * 0.3
+        self.baseline_latency = latency if self.baseline_latency is None else self.baseline_latency * 0.98 + latency * 0.02
+        if not self.adaptive:
+            return
+        if self.latency_tolerance and self.latency > self.baseline_latency * self.latency_tolerance:
+            self._decrease(now, 0.9, False)
+            return
+        if self.in_flight + 1 >= int(self.limit):
+            # Only grow a limit that is actually in use.
+            step = 1 if self.slow_start else 1 / self.limit
+            self.limit = min(self.max_concurrency, self.limit + step)
+        if self.rate is not None:
+            # Multiplicative increase, so a rate cut to min_rate recovers in minutes.
+            self.rate = self.rate + max(1 / 60, self.rate / 20)
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+
+    def _decrease(self, now, factor, throttled):
+        if now - self._decreased < (self.latency or 1.0):
+            return
+        self._decreased = now
+        self.slow_start = False
+        self.limit = max(1.0, self.limit * factor)
+        if throttled:
+            window = min(60.0, now - self._successes[0]) if self._successes else 0
+            observed = len(self._successes) / window if window > 0 else None
+            rates = [rate for rate in (self.rate, observed) if rate]
+            if rates:
+                self.rate = max(self.min_rate, min(rates) * factor)
+
+    def _publish(self):
+        # Only whole steps are reported, not every fractional increase.
+        values = {"concurrency limit": int(self.limit)}
+        if self.rate is not None:
+            values["requests per minute limit"] = int(self.rate * 60)
+        if self.metrics is None or values == self._published:
+            return
+        self._published = values
+        for name, value in values.items():
+            self.metrics.gauge(name, value)
+
+
+class RateControlledBackend:
+    def __init__(self, backend, controller):
+        self.backend = backend
+        self.controller = controller
+
+    def generate_content(self, contents, **kwargs):
+        started = self.controller.acquire()
+        try:
+            response = self.backend.generate_content(contents, **kwargs)
+        except KeysQuarantinedError as e:
+            # No request was sent: the key pool is sitting out earlier 429s, which
+            # were already counted.
+            self.controller.release(started, "error", e.retry_after)
+            raise
+        except RateLimitError as e:
+            self.controller.release(started, "throttled", e.retry_after)
+            raise
+        except OverloadedError as e:
+            self.controller.release(started, "overloaded", e.retry_after)
+            raise
+        except Exception:
+            self.controller.release(started, "error")
+            raise
+        self.controller.release(started, "ok")
+        return response
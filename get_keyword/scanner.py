@@ -0,0 +1,267 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+image_extensions = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".webp")
+
+
+def _excluded(path, exclude):
+    return os.path.normcase(os.path.abspath(path)) in exclude
+
+def _normalize(exclude):
+    return {os.path.normcase(os.path.abspath(path)) for path in exclude if path}
+
+def is_image(name, extensions=image_extensions):
+    return not name.startswith(".") and name.lower().endswith(extensions)
+
+def size_ok(size, min_size=1, max_size=0):
+    return size >= min_size and (not max_size or size <= max_size)
+
+def scan_images(directory, recursive=True, extensions=image_extensions, min_size=1, max_size=0, exclude=()):
+    # Yields image paths as os.scandir finds them, without listing the whole tree
+    # first. Hidden files and directories, symlinked directories and the
+    # directories in `exclude` (e.g. the output directory) are skipped.
+    exclude = _normalize(exclude)
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            entries = os.scandir(current)
+        except OSError as e:
+            print(f"Cannot read directory {current}: {e}")
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive and not entry.name.startswith(".") and not _excluded(entry.path, exclude):
+                            pending.append(entry.path)
+                    elif entry.is_file() and is_image(entry.name, extensions) and size_ok(entry.stat().st_size, min_size, max_size):
+                        yield entry.path
+                except OSError:
+                    continue
+
+
+IN_MODIFY = 0x2
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+_event = struct.Struct("iIII")
+
+
+class InotifyWatch:
+    # Watches a directory tree with inotify through ctypes. wait() returns
+    # (changed, removed, rescan): paths written or moved in, paths deleted or moved
+    # out, and the directories the caller has to rescan: new directories, or the
+    # whole tree if events were lost. Files created
+    # or modified are writing() until they are closed; a writer that dies is closed
+    # by the kernel, so that always comes.
+    mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    def __init__(self, directory, recursive=True, exclude=()):
+        self.directory = directory
+        self.recursive = recursive
+        self.exclude = _normalize(exclude)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._dirs = {}
+        self._writing = set()
+        try:
+            self._watch_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _watch(self, directory):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self._dirs[wd] = directory
+
+    def _watch_tree(self, directory):
+        self._watch(directory)
+        if not self.recursive:
+            return
+        for root, dirs, _ in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and not _excluded(os.path.join(root, d), self.exclude)]
+            for d in dirs:
+                self._watch(os.path.join(root, d))
+
+    def wait(self, timeout):
+        changed, removed, rescan = set(), set(), set()
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return changed, removed, rescan
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return changed, removed, rescan
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = _event.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + _event.size:offset + _event.size + length].rstrip(b"\0"))
+            offset += _event.size + length
+            if mask & IN_Q_OVERFLOW:
+                # Close events may be lost as well, fall back to the debounce.
+                self._writing.clear()
+                rescan.add(self.directory)
+                continue
+            directory = self._dirs.get(wd)
+            if mask & IN_IGNORED:
+                self._dirs.pop(wd, None)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO) and self.recursive and not name.startswith(".") and not _excluded(path, self.exclude):
+                    # Files may land in a new directory before its watch exists, so
+                    # the caller rescans it after adding it.
+                    try:
+                        self._watch_tree(path)
+                    except OSError as e:
+                        print(f"Cannot watch directory {path}: {e}")
+                    rescan.add(path)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._writing.discard(path)
+                removed.add(path)
+            elif mask & (IN_CREATE | IN_MODIFY):
+                self._writing.add(path)
+                changed.add(path)
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._writing.discard(path)
+                changed.add(path)
+        if self.directory in rescan:
+            rescan = {self.directory}
+        return changed, removed, rescan
+
+    def writing(self, path):
+        return path in self._writing
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class PollingWatch:
+    # Fallback for platforms without inotify: asks for a rescan every poll_interval.
+    def __init__(self, directory, poll_interval=5.0):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self._next = time.monotonic() + poll_interval
+
+    def writing(self, path):
+        return False
+
+    def wait(self, timeout):
+        now = time.monotonic()
+        if now < self._next:
+            time.sleep(min(timeout, self._next - now))
+            if time.monotonic() < self._next:
+                return set(), set(), set()
+        self._next = time.monotonic() + self.poll_interval
+        return set(), set(), {self.directory}
+
+    def close(self):
+        pass
+
+
+def open_watch(directory, recursive=True, exclude=(), poll_interval=5.0):
+    if hasattr(select, "select") and os.name == "posix":
+        try:
+            return InotifyWatch(directory, recursive, exclude)
+        except (OSError, AttributeError) as e:
+            print(f"inotify is not available ({e}), polling {directory} every {poll_interval:g}s")
+    return PollingWatch(directory, poll_interval)
+
+def watch_images(directory, cancel_event, recursive=True, extensions=image_extensions, min_size=1, max_size=0, exclude=(), debounce=2.0, poll_interval=5.0, active=None):
+    # Yields the images already in the tree as the scan finds them, then every
+    # image dropped into it until cancel_event is set. A file is only yielded once it is closed (with inotify)
+    # and its size and mtime have not changed for `debounce` seconds, so uploads in
+    # progress are not picked up half written. Paths in `active`, the images the
+    # consumer still has in flight, are held back until they are done. While idle
+    # it yields None about once a second, so the consumer can flush partial batches
+    # and check for cancellation.
+    active = active if active is not None else ()
+    watch = open_watch(directory, recursive, exclude, poll_interval)
+    pending = {}
+    emitted = {}
+    rescan = {directory}
+
+    def settled(path, seen, now):
+        # The (size, mtime) of a path that can be yielded now; anything else stays
+        # in pending.
+        if watch.writing(path) or path in active:
+            pending.setdefault(path, seen)
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            pending.pop(path, None)
+            return None
+        key = (stat.st_size, stat.st_mtime_ns)
+        if emitted.get(path) == key:
+            pending.pop(path, None)
+        elif seen is None and now - stat.st_mtime >= debounce or seen is not None and seen[0] == key and now - seen[1] >= debounce:
+            pending.pop(path, None)
+            return key
+        elif seen is None or seen[0] != key:
+            pending[path] = (key, now)
+        return None
+
+    try:
+        while not cancel_event.is_set():
+            for root in rescan:
+                found = set()
+                for path in scan_images(root, recursive, extensions, 0, 0, exclude):
+                    if cancel_event.is_set():
+                        break
+                    found.add(path)
+                    if path in emitted or path in pending:
+                        continue
+                    key = settled(path, None, time.time())
+                    if key and size_ok(key[0], min_size, max_size):
+                        emitted[path] = key
+                        yield path
+                else:
+                    if root == directory:
+                        # Files moved to the output directory no longer need remembering.
+                        for path in set(emitted) - found:
+                            del emitted[path]
+            if cancel_event.is_set():
+                break
+
+            now = time.time()
+            ready = []
+            for path, seen in list(pending.items()):
+                key = settled(path, seen, now)
+                if key:
+                    ready.append((path, key))
+            for path, key in ready:
+                if size_ok(key[0], min_size, max_size):
+                    emitted[path] = key
+                    yield path
+            if cancel_event.is_set():
+                break
+
+            yield None
+            changed, removed, rescan = watch.wait(min(1.0, debounce / 2) if pending else 1.0)
+            for path in removed:
+                emitted.pop(path, None)
+                pending.pop(path, None)
+            for path in changed:
+                if is_image(os.path.basename(path), extensions):
+                    pending[path] = None
+    finally:
+        watch.close()
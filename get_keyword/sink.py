@@ -0,0 +1,192 @@
+import csv
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+
+export_formats = {"csv": "metadata.csv", "jsonl": "metadata.jsonl", "parquet": "metadata.parquet"}
+columns = ["Filename", "Title", "Description", "Keywords", "Category", "Release"]
+
+_STOP = object()
+
+
+def _fsync(file):
+    file.flush()
+    os.fsync(file.fileno())
+
+def _fsync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class OutputSink:
+    # Rows are handed to a single writer thread, which appends them in batches to
+    # `<path>.partial` and fsyncs it periodically. close() moves the partial file
+    # over `path` atomically. A partial file left behind by a crash is picked up
+    # again by the next run, so rows that were already flushed are not lost.
+    partial_suffix = ".partial"
+
+    def __init__(self, path, flush_every=100, flush_interval=5.0):
+        self.path = path
+        self.partial_path = path + self.partial_suffix
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._error = None
+        self._file = None
+        self._thread = None
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        if not os.path.exists(self.partial_path):
+            self._start_partial()
+        self._file = open(self.partial_path, "a", newline="", encoding="utf-8")
+        self._thread = threading.Thread(target=self._run, name="output-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def _start_partial(self):
+        if os.path.exists(self.path):
+            shutil.copyfile(self.path, self.partial_path)
+
+    def write(self, row):
+        if self._error is not None:
+            raise self._error
+        self._queue.put(row)
+
+    def _run(self):
+        buffer = []
+        last_flush = time.monotonic()
+        while True:
+            try:
+                row = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                row = None
+            if row is not _STOP and row is not None:
+                buffer.append(row)
+            due = time.monotonic() - last_flush >= self.flush_interval
+            if buffer and (row is _STOP or len(buffer) >= self.flush_every or due):
+                try:
+                    self._write_rows(self._file, buffer)
+                    _fsync(self._file)
+                    self.rows += len(buffer)
+                except Exception as e:
+                    self._error = e
+                    print(f"Error writing {self.partial_path}: {e}")
+                buffer = []
+                last_flush = time.monotonic()
+            if row is _STOP:
+                return
+
+    def _write_rows(self, file, rows):
+        raise NotImplementedError
+
+    def append(self, rows):
+        # Appends rows straight to the output file, for a few rows at a time where
+        # copying the whole file to .partial and back would cost more than the rows.
+        # A partial file left by an interrupted run gets them too, so resuming and
+        # finalizing it later does not drop them. Not for use on an open sink.
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        paths = [self.path] + ([self.partial_path] if os.path.exists(self.partial_path) else [])
+        for path in paths:
+            with open(path, "a", newline="", encoding="utf-8") as f:
+                self._write_rows(f, rows)
+                _fsync(f)
+
+    def _finalize(self):
+        os.replace(self.partial_path, self.path)
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+        if self._error is not None:
+            raise self._error
+        self._finalize()
+        _fsync_directory(self.path)
+
+    def __enter__(self):
+        if self._thread is None:
+            self.open()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class CsvSink(OutputSink):
+    def _write_rows(self, file, rows):
+        writer = csv.writer(file)
+        if file.tell() == 0:
+            writer.writerow(columns)
+        writer.writerows([[row.get(column, "") for column in columns] for row in rows])
+
+
+class JsonlSink(OutputSink):
+    def _write_rows(self, file, rows):
+        for row in rows:
+            file.write(json.dumps({column: row.get(column, "") for column in columns}, ensure_ascii=False) + "\n")
+
+
+class ParquetSink(JsonlSink):
+    # Parquet cannot be appended to, so rows are collected in a JSON lines partial
+    # file and converted together with any existing output when the sink closes.
+    partial_suffix = ".partial.jsonl"
+
+    def _start_partial(self):
+        pass
+
+    def append(self, rows):
+        # Parquet cannot be appended to, so this is a whole sink run.
+        with self:
+            for row in rows:
+                self.write(row)
+
+    def _finalize(self):
+        import pandas as pd
+
+        frames = []
+        if os.path.exists(self.path):
+            frames.append(pd.read_parquet(self.path))
+        if os.path.getsize(self.partial_path):
+            frames.append(pd.read_json(self.partial_path, lines=True, dtype=False))
+        if frames:
+            temp_path = self.path + ".tmp"
+            pd.concat(frames, ignore_index=True).reindex(columns=columns).to_parquet(temp_path, index=False)
+            os.replace(temp_path, self.path)
+        os.remove(self.partial_path)
+
+
+def check_export_format(export_format):
+    if export_format not in export_formats:
+        raise ValueError(f"Unknown export format: {export_format}")
+    if export_format == "parquet":
+        # pandas needs pyarrow or fastparquet to write Parquet.
+        try:
+            import pyarrow
+        except ImportError:
+            try:
+                import fastparquet
+            except ImportError:
+                raise ValueError("Parquet export needs pyarrow or fastparquet, install one with pip") from None
+
+def create_sink(output_dir, export_format="csv", **kwargs):
+    sink_class = {"csv": CsvSink, "jsonl": JsonlSink, "parquet": ParquetSink}[export_format]
+    return sink_class(os.path.join(output_dir, export_formats[export_format]), **kwargs)
+
+def open_sink(output_dir, export_format="csv", **kwargs):
+    return create_sink(output_dir, export_format, **kwargs).open()
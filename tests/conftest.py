@@ -0,0 +1,14 @@
+import pytest
+from PIL import Image
+
+
+@pytest.fixture
+def make_images(tmp_path):
+    # Writes `count` small JPEGs of different colours and returns their directory.
+    def make(count, directory="in"):
+        path = tmp_path / directory
+        path.mkdir(exist_ok=True)
+        for i in range(count):
+            Image.new("RGB", (64, 48), (i * 40 % 256, i * 7 % 256, 255 - i * 20 % 256)).save(path / f"image{i}.jpg")
+        return path
+    return make
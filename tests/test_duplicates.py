@@ -0,0 +1,43 @@
+import random
+
+from get_keyword.duplicates import DuplicateIndex, MultiIndexHash, hamming_distance
+
+
+def test_multi_index_hash_matches_brute_force():
+    rng = random.Random(1)
+    keys = [rng.getrandbits(64) for _ in range(500)]
+    # Near copies of some keys, a few bits flipped.
+    for key in keys[:50]:
+        keys.append(key ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)))
+    index = MultiIndexHash()
+    for i, key in enumerate(keys):
+        index.add(key, i)
+    assert len(index) == len(keys)
+    for query in keys[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        for distance in (0, 3, 6, 10):
+            expected = sorted(i for i, key in enumerate(keys) if hamming_distance(query, key) <= distance)
+            assert sorted(value for _, _, value in index.search(query, distance)) == expected
+
+
+def test_multi_index_hash_nearest():
+    index = MultiIndexHash()
+    index.add(0b1111, "far")
+    index.add(0b0001, "near")
+    assert index.nearest(0, 6) == (1, 0b0001, "near")
+    assert index.nearest(1 << 40, 0) is None
+
+
+def test_duplicate_index_claims(tmp_path):
+    duplicates = DuplicateIndex(str(tmp_path / "duplicates.sqlite"))
+    match, claim = duplicates.lookup_or_claim(0b1, 2)
+    assert match is None and claim is not None
+    # A near-duplicate of a hash still in flight does not get a claim of its own.
+    assert duplicates.lookup_or_claim(0b11, 2, timeout=0) == (None, None)
+    duplicates.add(0b1, "/images/a.jpg", {"title": "A"}, claim)
+    match, claim = duplicates.lookup_or_claim(0b11, 2)
+    assert match == (1, "/images/a.jpg", {"title": "A"}) and claim is None
+    duplicates.close()
+
+    reopened = DuplicateIndex(str(tmp_path / "duplicates.sqlite"))
+    assert reopened.lookup_or_claim(0b1, 0)[0][1] == "/images/a.jpg"
+    reopened.close()
@@ -0,0 +1,99 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from get_keyword.backends import BlockedError
+from get_keyword.core import ImageJob, Settings, _infer_batch
+from get_keyword.gemini import generate_metadata, parse_batch_response, response_text
+
+
+def entry(index, title="A title"):
+    return {"index": index, "title": title, "description": "A description", "keywords": ["a", "b"], "filename": "name"}
+
+
+def test_parse_batch_response_maps_indexes():
+    text = "```json\n" + json.dumps([entry(2, "Second"), entry(1, "First")]) + "\n```"
+    results = parse_batch_response(text, 2)
+    assert results[1]["title"] == "First"
+    assert results[2]["title"] == "Second"
+
+
+def test_parse_batch_response_drops_bad_entries():
+    data = [entry(1), entry(3), entry(3), entry(5), {"index": 4, "title": ""}, "junk", dict(entry(2), index="x")]
+    assert set(parse_batch_response(json.dumps(data), 4)) == {1}
+
+
+def test_parse_batch_response_needs_an_array():
+    with pytest.raises(ValueError):
+        parse_batch_response(json.dumps({"index": 1, "title": "A title"}), 1)
+    with pytest.raises(ValueError):
+        parse_batch_response("no json here", 1)
+
+
+class PartialModel:
+    # Answers only the first image of every packed request.
+    def __init__(self):
+        self.requests = []
+
+    def generate_content(self, contents, generation_config=None, safety_settings=None):
+        images = [part for part in contents if isinstance(part, dict)]
+        self.requests.append(len(images))
+        if generation_config["response_schema"]["type"] == "array":
+            text = json.dumps([entry(1, images[0]["data"].decode())])
+        else:
+            text = json.dumps(dict(entry(1, images[0]["data"].decode()), index=None))
+        return SimpleNamespace(text=text)
+
+
+def jobs(count):
+    result = []
+    for i in range(count):
+        job = ImageJob(f"/images/{i}.jpg")
+        job.image_bytes = f"image {i}".encode()
+        job.mime_type = "image/jpeg"
+        result.append(job)
+    return result
+
+
+def test_infer_batch_splits_missing_entries():
+    model = PartialModel()
+    batch = jobs(4)
+    errors, single = {}, set()
+    _infer_batch(batch, model, Settings(), errors, single)
+    assert errors == {}
+    assert [job.metadata["title"] for job in batch] == [f"image {i}" for i in range(4)]
+    # 4 -> 3 missing, split into 2 + 1 -> 1 missing of the 2 goes alone.
+    assert model.requests == [4, 2, 1, 1]
+    assert single == {batch[2], batch[3]}
+
+
+def test_infer_batch_reports_request_errors_per_job():
+    class Failing:
+        def generate_content(self, contents, **kwargs):
+            raise RuntimeError("boom")
+
+    batch = jobs(3)
+    errors = {}
+    _infer_batch(batch, Failing(), Settings(), errors, set())
+    assert set(errors) == set(batch)
+
+
+def test_blocked_response_does_not_fall_back():
+    calls = []
+
+    class Blocked:
+        def generate_content(self, contents, **kwargs):
+            calls.append(contents)
+            candidate = SimpleNamespace(finish_reason=SimpleNamespace(name="SAFETY"))
+            return SimpleNamespace(prompt_feedback=SimpleNamespace(block_reason=0), candidates=[candidate])
+
+    with pytest.raises(BlockedError):
+        generate_metadata(Blocked(), {"mime_type": "image/jpeg", "data": b""})
+    assert len(calls) == 1
+
+
+def test_response_text_reports_blocked_prompt():
+    response = SimpleNamespace(prompt_feedback=SimpleNamespace(block_reason=SimpleNamespace(name="OTHER")), candidates=[])
+    with pytest.raises(BlockedError, match="OTHER"):
+        response_text(response)
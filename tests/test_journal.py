@@ -0,0 +1,48 @@
+import os
+
+from get_keyword import journal as states
+from get_keyword.core import ImageJob
+from get_keyword.journal import Journal
+
+metadata = {"title": "A title", "description": "A description", "keywords": ["a"], "filename": "a"}
+
+
+def recorded(tmp_path, state, **kwargs):
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"image")
+    journal = Journal(str(tmp_path / "journal.sqlite"))
+    job = ImageJob(str(image))
+    job.metadata = metadata
+    job.state = state
+    journal.record(job, **kwargs)
+    journal.close()
+    return str(image), Journal(str(tmp_path / "journal.sqlite"))
+
+
+def test_restore_resumes_after_inference(tmp_path):
+    image, journal = recorded(tmp_path, states.INFERRED, failed=True)
+    assert journal.get(image)["state"] == states.FAILED
+    job = ImageJob(image)
+    assert journal.restore(job)
+    assert job.state == states.INFERRED
+    assert job.metadata == metadata
+
+
+def test_restore_skips_early_stages(tmp_path):
+    image, journal = recorded(tmp_path, states.PREPARED, cancelled=True)
+    assert journal.get(image)["state"] == states.CANCELLED
+    assert not journal.restore(ImageJob(image))
+
+
+def test_restore_skips_changed_file(tmp_path):
+    image, journal = recorded(tmp_path, states.WRITTEN)
+    with open(image, "ab") as f:
+        f.write(b"more")
+    assert not journal.restore(ImageJob(image))
+    os.remove(image)
+    assert not journal.restore(ImageJob(image))
+
+
+def test_summary_counts_states(tmp_path):
+    _, journal = recorded(tmp_path, states.MOVED)
+    assert journal.summary() == {states.MOVED: 1}
@@ -0,0 +1,105 @@
+import csv
+import os
+import queue
+import threading
+
+import pytest
+
+from get_keyword import journal as states
+from get_keyword import pipeline
+from get_keyword.backends import FakeBackend
+from get_keyword.core import ImageJob, Settings
+from get_keyword.journal import Journal, default_journal_path
+from get_keyword.pipeline import process_images
+
+
+@pytest.fixture(autouse=True)
+def no_exiftool(monkeypatch):
+    # Tags are written by exiftool, which the tests do not need.
+    monkeypatch.setattr(pipeline, "write_metadata", lambda job: None)
+    monkeypatch.setattr(pipeline, "write_metadata_batch", lambda jobs: {})
+
+
+def settings(tmp_path, input_dir, **kwargs):
+    options = dict(backend="fake", cache_path=str(tmp_path / "cache.sqlite"), prepare_in_processes=False, workers=2, retry_base_delay=0.01)
+    options.update(kwargs)
+    return Settings(str(input_dir), str(tmp_path / "out"), **options)
+
+
+def events(run):
+    inbox = queue.Queue()
+    run(inbox)
+    result = []
+    while not inbox.empty():
+        result.append(inbox.get())
+    return result
+
+
+@pytest.mark.parametrize("batch_size", [1, 3])
+def test_pipeline_processes_and_exports(tmp_path, make_images, batch_size):
+    input_dir = make_images(5)
+    config = settings(tmp_path, input_dir, export_csv=True, batch_size=batch_size, batch_wait=0.05)
+    done = events(lambda inbox: process_images(config, inbox, model=FakeBackend(latency=0.01, jitter=0)))[-1]
+    assert done == ("done", "Processing complete.", 5, 0)
+    assert os.listdir(input_dir) == []
+    assert sorted(os.listdir(tmp_path / "out")) == sorted([f"image{i}.jpg" for i in range(5)] + ["metadata.csv", os.path.basename(default_journal_path(""))])
+    with open(tmp_path / "out" / "metadata.csv", newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row["Filename"] for row in rows) == [f"image{i}.jpg" for i in range(5)]
+    assert all(row["Title"] and row["Keywords"] for row in rows)
+    journal = Journal(default_journal_path(config.output_dir))
+    assert journal.summary() == {states.MOVED: 5}
+    journal.close()
+
+
+def test_pipeline_retries_then_fails(tmp_path, make_images):
+    input_dir = make_images(2)
+    config = settings(tmp_path, input_dir, max_attempts=2, cache_enabled=False)
+    model = FakeBackend(latency=0, error_rate=1.0)
+    done = events(lambda inbox: process_images(config, inbox, model=model))[-1]
+    assert done[2:] == (0, 2)
+    assert model.requests == 4
+    assert sorted(os.listdir(input_dir)) == ["image0.jpg", "image1.jpg"]
+    journal = Journal(default_journal_path(config.output_dir))
+    assert journal.summary() == {states.FAILED: 2}
+    journal.close()
+
+
+def test_pipeline_resumes_from_journal(tmp_path, make_images):
+    input_dir = make_images(1)
+    config = settings(tmp_path, input_dir, cache_enabled=False)
+    # A previous run got the metadata but stopped before writing it.
+    image = str(input_dir / "image0.jpg")
+    journal = Journal(default_journal_path(config.output_dir))
+    job = ImageJob(image)
+    job.state = states.INFERRED
+    job.metadata = {"title": "Kept", "description": "Kept", "keywords": ["kept"], "filename": "kept"}
+    journal.record(job, failed=True)
+    journal.close()
+
+    model = FakeBackend(latency=0)
+    done = events(lambda inbox: process_images(config, inbox, model=model))[-1]
+    assert done[2:] == (1, 0)
+    assert model.requests == 0
+
+
+def test_stop_counts_jobs_as_cancelled(tmp_path, make_images):
+    input_dir = make_images(4)
+    config = settings(tmp_path, input_dir, cache_enabled=False, workers=1)
+    cancel_event = threading.Event()
+    model = FakeBackend(latency=0.2, jitter=0)
+    original = model.generate_content
+
+    def generate_content(*args, **kwargs):
+        cancel_event.set()
+        return original(*args, **kwargs)
+
+    model.generate_content = generate_content
+    done = events(lambda inbox: process_images(config, inbox, cancel_event, model))[-1]
+    assert done[1].startswith("Processing cancelled.")
+    assert done[3] == 0
+    journal = Journal(default_journal_path(config.output_dir))
+    summary = journal.summary()
+    journal.close()
+    assert states.FAILED not in summary
+    assert summary.get(states.CANCELLED)
@@ -0,0 +1,104 @@
+import pytest
+
+from get_keyword import ratecontrol
+from get_keyword.keys import KeysQuarantinedError
+from get_keyword.ratecontrol import RateControlledBackend, RateController
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratecontrol.time, "monotonic", lambda: now[0])
+    return now
+
+
+def request(controller, clock, outcome, latency=1.0, retry_after=None):
+    started = controller.acquire()
+    clock[0] += latency
+    controller.release(started, outcome, retry_after)
+
+
+def test_limit_grows_only_while_in_use(clock):
+    controller = RateController(16)
+    assert controller.limit == 1
+    request(controller, clock, "ok")
+    assert controller.limit == 2
+    # One request at a time does not use a limit of two.
+    request(controller, clock, "ok")
+    assert controller.limit == 2
+    started = [controller.acquire(), controller.acquire()]
+    clock[0] += 1
+    for time in started:
+        controller.release(time, "ok")
+    assert controller.limit == 3
+
+
+def test_error_ends_slow_start(clock):
+    controller = RateController(16)
+    controller.limit = 8.0
+    request(controller, clock, "overloaded")
+    assert controller.limit == 4
+    assert not controller.slow_start
+    # Additive increase from now on: about one per round trip.
+    controller.in_flight = 3
+    request(controller, clock, "ok")
+    assert controller.limit == 4.25
+
+
+def test_errors_within_one_round_trip_count_once(clock):
+    controller = RateController(16)
+    controller.limit = 8.0
+    request(controller, clock, "ok")
+    request(controller, clock, "throttled", latency=0)
+    request(controller, clock, "throttled", latency=0)
+    assert controller.limit == 4
+
+
+def test_first_429_does_not_pin_the_rate(clock):
+    controller = RateController(8)
+    controller.limit = 8.0
+    request(controller, clock, "throttled")
+    assert controller.rate is None
+    assert controller.limit == 4
+
+
+def test_429_throttles_rate_below_throughput(clock):
+    controller = RateController(8, requests_per_minute=600)
+    controller.slow_start = False
+    for _ in range(10):
+        request(controller, clock, "ok", latency=0.5)
+    request(controller, clock, "throttled", latency=0.5)
+    # 10 successes in the 5s since the first one, halved.
+    assert controller.rate == pytest.approx(1.0)
+    rate = controller.rate
+    request(controller, clock, "ok", latency=0.5)
+    assert controller.rate == pytest.approx(rate + max(1 / 60, rate / 20))
+
+
+def test_rate_has_a_floor(clock):
+    controller = RateController(8, requests_per_minute=60)
+    for _ in range(10):
+        clock[0] += 20
+        request(controller, clock, "throttled")
+    assert controller.rate == controller.min_rate == 0.1
+
+
+def test_retry_after_pauses_requests(clock):
+    controller = RateController(8)
+    request(controller, clock, "throttled", retry_after=30)
+    assert controller.paused_until == clock[0] + 30
+
+
+def test_quarantined_keys_are_not_a_throttle(clock):
+    class Quarantined:
+        def generate_content(self, contents, **kwargs):
+            raise KeysQuarantinedError("All API keys are rate limited", 5)
+
+    controller = RateController(8)
+    controller.limit = 4.0
+    backend = RateControlledBackend(Quarantined(), controller)
+    with pytest.raises(KeysQuarantinedError):
+        backend.generate_content([])
+    assert controller.limit == 4
+    assert controller.in_flight == 0
+    assert controller.paused_until == clock[0] + 5
@@ -0,0 +1,56 @@
+import csv
+import json
+import os
+import shutil
+
+import pytest
+
+from get_keyword.sink import CsvSink, JsonlSink, create_sink
+
+
+def row(name):
+    return {"Filename": name, "Title": f"Title {name}", "Keywords": "a,b"}
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [line["Filename"] for line in csv.DictReader(f)]
+
+
+def test_csv_sink_resumes_partial(tmp_path):
+    path = str(tmp_path / "metadata.csv")
+    with CsvSink(path) as sink:
+        sink.write(row("a"))
+    # A run that crashed after flushing a row leaves the partial file behind.
+    shutil.copyfile(path, path + ".partial")
+    with open(path + ".partial", "a", newline="", encoding="utf-8") as f:
+        csv.writer(f).writerow(["b", "Title b", "", "a,b", "", ""])
+    with CsvSink(path) as sink:
+        sink.write(row("c"))
+    assert read_csv(path) == ["a", "b", "c"]
+    assert not os.path.exists(path + ".partial")
+
+
+def test_append_also_goes_to_partial(tmp_path):
+    path = str(tmp_path / "metadata.jsonl")
+    JsonlSink(path).append([row("a")])
+    with open(path + ".partial", "w", encoding="utf-8") as f:
+        f.write(json.dumps(row("a")) + "\n")
+    JsonlSink(path).append([row("b")])
+    with JsonlSink(path):
+        pass
+    with open(path, encoding="utf-8") as f:
+        assert [json.loads(line)["Filename"] for line in f] == ["a", "b"]
+
+
+def test_parquet_sink_resumes_partial(tmp_path):
+    pd = pytest.importorskip("pandas")
+    pytest.importorskip("pyarrow")
+    with create_sink(str(tmp_path), "parquet") as sink:
+        sink.write(row("a"))
+    sink = create_sink(str(tmp_path), "parquet")
+    with open(sink.partial_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(row("b")) + "\n")
+    with sink:
+        sink.write(row("c"))
+    assert list(pd.read_parquet(sink.path)["Filename"]) == ["a", "b", "c"]